@@ -0,0 +1,79 @@
+import json
+import numpy as np
+import os
+
+from pathlib import Path
+
+__all__ = ["load_history", "load_trials"]
+
+def _map_columns(directory: Path) -> dict:
+    """
+    Memory-map every column described by directory/header.json, up to the last complete row
+    """
+    with open(directory / "header.json") as header_file:
+        header = json.load(header_file)
+
+    columns = {
+        name: (np.dtype(spec["dtype"]), tuple(spec["shape"]))
+        for (name, spec) in header["columns"].items()
+    }
+
+    # a running supervisor may be part way through writing, so only return complete rows
+    rows = min(
+        os.path.getsize(directory / f"{name}.bin") // (dtype.itemsize * int(np.prod(shape)))
+        for (name, (dtype, shape)) in columns.items()
+    )
+
+    if rows == 0:
+        return {name: np.empty((0, *shape), dtype=dtype) for (name, (dtype, shape)) in columns.items()}
+
+    return {
+        name: np.memmap(directory / f"{name}.bin", dtype=dtype, mode="r", shape=(rows, *shape))
+        for (name, (dtype, shape)) in columns.items()
+    }
+
+def load_history(run_dir):
+    """
+    Load the population at the end of every generation from the history index written by the ML
+    supervisor into run_dir/history
+
+    Arguments:
+    run_dir -- the directory the supervisor was run in
+
+    Returns:
+    (generations, populations, energies) - the generation numbers, with the initial population as
+    generation -1, shape (generations,); the scaled populations, shape (generations, popsize, dims);
+    and their energies, which are the negated goal values, shape (generations, popsize). The best
+    member of each generation is first. The arrays are memory-mapped unless generations were rerun
+    """
+    columns = _map_columns(Path(run_dir) / "history")
+    generations = columns["generation"]
+
+    if np.all(np.diff(generations) > 0):
+        return generations, columns["population"], columns["population_energies"]
+
+    # a run resumed at an earlier generation has rerun the generations after it, so work back from
+    # the end keeping only the rows which precede every row already kept
+    rows = []
+    for row in range(len(generations) - 1, -1, -1):
+        if not rows or generations[row] < generations[rows[-1]]:
+            rows.append(row)
+
+    rows = rows[::-1]
+    return generations[rows], columns["population"][rows], columns["population_energies"][rows]
+
+def load_trials(run_dir, fidelity: float = 1.) -> dict:
+    """
+    Memory-map the trial store written by the ML supervisor into run_dir/trials, or the store of
+    trials screened at a lower fidelity
+
+    Arguments:
+    run_dir -- the directory the supervisor was run in
+    fidelity -- the fidelity of the trials, one of those passed to --fidelity if below 1
+
+    Returns:
+    A dict of read-only arrays keyed on column name - par_vec, energy, generation, runtime, rank,
+    pruned and cached - with one row per trial in the order the trials completed. energy is the
+    negated goal value, and generation is -1 for the initial population
+    """
+    return _map_columns(Path(run_dir) / ("trials" if fidelity == 1. else f"trials_{fidelity:g}"))
@@ -1,120 +1,200 @@
+import hashlib
+import io
+import matplotlib
+matplotlib.use("Agg")  # frames are rendered in worker processes, off screen
 import matplotlib.pyplot as plt
 import numpy as np
+import os
 
-from collections import deque
-from glob import glob
-from itertools import islice
-from matplotlib.animation import FuncAnimation
+from concurrent.futures import ProcessPoolExecutor
+from matplotlib.collections import PolyCollection
 from pathlib import Path
+from PIL import Image
 from scipy.constants import c, e, epsilon_0, m_e, pi
 
-from stubs import load_stub
+from history import load_history, load_trials
 
 wavelength = 800.e-9
 omega = 2 * pi * c / wavelength
 
-filepath = Path("density_ml_best1bin_150")
-solver_files = sorted(glob(f"{filepath.absolute()}/solver*.pickle"))  # file paths aren't sorted on ext4
-solver_files = np.roll(solver_files, 1)  # move init to start of list
-
-solvers = []
-
-for sf in solver_files:
-    with open(sf, "rb") as sh:
-        solvers.append(load_stub(sh))
-
-populations = []
-energies = []
-
-for solver in solvers:
-    populations.append(solver._scale_parameters(solver.population))
-    energies.append(-solver.population_energies)
-
-populations = np.array(populations)
-energies = np.array(energies)
-
-print(populations[-1][0], energies[-1][0])
-
-# Energy Evolution
-results = []
-
-for energy in energies:
-    results.append((np.min(energy), (np.average(energy), np.std(energy)), np.max(energy)))
-
-fig, ax = plt.subplots(num=1)
-minimums, averages, maximums = zip(*results)
-avgs, errs = zip(*averages)
-avgs = np.array(avgs)
-errs = np.array(errs)
-ax.plot(minimums, label="Minimum", color="blue")
-ax.plot(avgs, label="Average", color="black")
-ax.fill_between(np.arange(len(avgs)), avgs - errs, avgs + errs, facecolor="gray", alpha=0.4)
-ax.plot(maximums, label="Maximum", color="red")
-ax.set_xlim((0, len(energies)))
-ax.set_ylim((0, np.max(maximums) * 1.1))
-
-ax.set_xlabel("Generation")
-ax.set_ylabel("Energy (arb. units)")
-ax.legend()
-
-fig.savefig("energy_evolution.png", dpi=400)
-
-# Pop Evolution
-fig, ax_anim = plt.subplots(num=2)
-x_axis = (np.arange(len(populations[0][0])) + 0.5) * 5e-7
-generation = 0
-
-def update(pop):
-    global generation
-    ax_anim.clear()
-    ax_anim.set_title(f"Generation {generation}")
-    generation += 1
-    ax_anim.set_xlim((0, 5e-6))
-    ax_anim.set_ylim((0, 10))
-    ax_anim.set_xlabel(r"x ($\mu m$)")
-    ax_anim.set_ylabel(r"Density (relative to $n_{crit}$)")
-    for profile in pop[1:]:
-        ax_anim.bar(x_axis, profile, width=5e-7, color="None", edgecolor="black", alpha=0.2)
-    
-    ax_anim.plot((0, 5e-6), (1, 1), color="cyan", alpha=0.5)
-    ax_anim.bar(x_axis, pop[0], width=5e-7, color="None", edgecolor="red", linewidth=2, label="Best")
-
-    ax_anim.legend(loc="upper left")
-
-ani = FuncAnimation(fig, update, frames=populations, interval=50).save("pop_evolution.gif", dpi=400)
-
-# Trial Evolution
-gen_files = sorted(glob(f"{filepath.absolute()}/gen*.csv"))
-gen_files = np.roll(gen_files, 1)
-
-trials = []
-
-for gf in gen_files:
-    with open(gf, 'r') as gh:
-        trials.append(np.loadtxt(gh, delimiter=",")[:,:10])
-
-fig, ax_anim = plt.subplots(num=3)
-generation = 0
-
-ani = FuncAnimation(fig, update, frames=trials, interval=50).save("trial_evolution.gif", dpi=400)
-
-# Best Evolution
-fig, ax_anim = plt.subplots(num=4)
-bests = deque([], 50)
-generation = 0
-
-def update(pop):
-    global generation
-    ax_anim.clear()
-    ax_anim.set_title(f"Best at generation {generation}")
-    generation += 1
-    ax_anim.set_xlim((0, 5e-6))
-    ax_anim.set_ylim((0, 10))
-    ax_anim.set_xlabel(r"x ($\mu m$)")
-    ax_anim.set_ylabel(r"Density (relative to $n_{crit}$)")
-    bests.appendleft(pop[0])
-    for i, profile in islice(enumerate(bests), 1, len(bests)):
-        ax_anim.bar(x_axis, profile, width=5e-7, color="None", edgecolor="black", alpha=1/(i + 1))
-    ax_anim.bar(x_axis, bests[0], width=5e-7, color="None", edgecolor="red")
-
-ani = FuncAnimation(fig, update, frames=populations, interval=200).save("best_evolution.gif", dpi=400)
+bar_width = 5e-7
+dpi = 400
+
+# each worker process keeps one figure, and clears it between frames
+figure = None
+
+def bar_outlines(profiles: np.ndarray) -> np.ndarray:
+    """
+    The outline of every bar of every profile, as the vertices of one rectangle per bar
+
+    Arguments:
+    profiles -- density profiles, shape (profiles, bars)
+
+    Returns:
+    Vertices, shape (profiles * bars, 4, 2)
+    """
+    left = np.arange(profiles.shape[1]) * bar_width
+    heights = profiles.ravel()
+    lefts = np.tile(left, profiles.shape[0])
+
+    return np.stack([
+        np.stack([lefts, np.zeros_like(heights)], axis=-1),
+        np.stack([lefts, heights], axis=-1),
+        np.stack([lefts + bar_width, heights], axis=-1),
+        np.stack([lefts + bar_width, np.zeros_like(heights)], axis=-1)
+    ], axis=1)
+
+def render_frame(path: Path, kind: str, title: str, profiles: np.ndarray):
+    """
+    Render one animation frame to a PNG, drawing every profile but the first as a single collection
+
+    Arguments:
+    path -- where to save the frame
+    kind -- "population", to draw the first profile as the best of the rest, or "best", to draw
+        older bests fading out behind the first
+    title -- the frame's title
+    profiles -- density profiles, shape (profiles, bars)
+    """
+    global figure
+
+    if figure is None:
+        figure = plt.figure()
+
+    figure.clear()
+    ax = figure.add_subplot()
+
+    ax.set_title(title)
+    ax.set_xlim((0, 5e-6))
+    ax.set_ylim((0, 10))
+    ax.set_xlabel(r"x ($\mu m$)")
+    ax.set_ylabel(r"Density (relative to $n_{crit}$)")
+
+    bars = profiles.shape[1]
+
+    if kind == "population":
+        ax.add_collection(PolyCollection(bar_outlines(profiles[1:]), facecolors="none", edgecolors="black", alpha=0.2))
+        ax.plot((0, 5e-6), (1, 1), color="cyan", alpha=0.5)
+        ax.add_collection(PolyCollection(bar_outlines(profiles[:1]), facecolors="none", edgecolors="red", linewidths=2, label="Best"))
+        ax.legend(loc="upper left")
+    else:
+        alphas = np.repeat(1 / (np.arange(1, len(profiles)) + 1), bars)
+        edges = np.zeros((len(alphas), 4))
+        edges[:, 3] = alphas
+        ax.add_collection(PolyCollection(bar_outlines(profiles[1:]), facecolors="none", edgecolors=edges))
+        ax.add_collection(PolyCollection(bar_outlines(profiles[:1]), facecolors="none", edgecolors="red"))
+
+    # quantise while rendering in parallel, so assembling the GIF needs no further conversion
+    buffer = io.BytesIO()
+    figure.savefig(buffer, dpi=dpi)
+
+    path.parent.mkdir(parents=True, exist_ok=True)
+    Image.open(buffer).convert("RGB").quantize(colors=256).save(path)
+
+def animate(name: str, kind: str, titles: list, frames: list, interval: int, executor: ProcessPoolExecutor):
+    """
+    Render each frame not rendered by a previous run, then assemble every frame into name.gif
+
+    Frames are kept in frames/name, named after a hash of their contents, so frames from earlier
+    runs are reused while any whose data has since changed are rendered again
+
+    Arguments:
+    name -- the name of the animation
+    kind -- passed to render_frame
+    titles -- each frame's title
+    frames -- each frame's profiles, see render_frame
+    interval -- the time each frame is shown for, in ms
+    executor -- the process pool to render with
+    """
+    paths = []
+
+    for (index, (title, profiles)) in enumerate(zip(titles, frames)):
+        digest = hashlib.sha1(f"{kind}{title}{dpi}".encode() + np.ascontiguousarray(profiles).tobytes()).hexdigest()
+        paths.append(Path("frames") / name / f"{index:0>4d}-{digest[:12]}.png")
+
+    missing = [i for (i, path) in enumerate(paths) if not path.exists()]
+
+    print(f"{name}: rendering {len(missing)} of {len(paths)} frames")
+
+    list(executor.map(
+        render_frame,
+        [paths[i] for i in missing],
+        [kind] * len(missing),
+        [titles[i] for i in missing],
+        [np.asarray(frames[i]) for i in missing],
+        chunksize=max(1, len(missing) // (4 * os.cpu_count()))
+    ))
+
+    images = [Image.open(path) for path in paths]
+    images[0].save(f"{name}.gif", save_all=True, append_images=images[1:], duration=interval, loop=0)
+
+def main():
+    filepath = Path("density_ml_best1bin_150")
+
+    (_, populations, energies) = load_history(filepath)
+    energies = -energies
+
+    print(populations[-1][0], energies[-1][0])
+
+    # Energy Evolution
+    results = []
+
+    for energy in energies:
+        results.append((np.min(energy), (np.average(energy), np.std(energy)), np.max(energy)))
+
+    fig, ax = plt.subplots(num=1)
+    minimums, averages, maximums = zip(*results)
+    avgs, errs = zip(*averages)
+    avgs = np.array(avgs)
+    errs = np.array(errs)
+    ax.plot(minimums, label="Minimum", color="blue")
+    ax.plot(avgs, label="Average", color="black")
+    ax.fill_between(np.arange(len(avgs)), avgs - errs, avgs + errs, facecolor="gray", alpha=0.4)
+    ax.plot(maximums, label="Maximum", color="red")
+    ax.set_xlim((0, len(energies)))
+    ax.set_ylim((0, np.max(maximums) * 1.1))
+
+    ax.set_xlabel("Generation")
+    ax.set_ylabel("Energy (arb. units)")
+    ax.legend()
+
+    fig.savefig("energy_evolution.png", dpi=400)
+
+    with ProcessPoolExecutor() as executor:
+        # Pop Evolution
+        animate(
+            "pop_evolution",
+            "population",
+            [f"Generation {generation}" for generation in range(len(populations))],
+            populations,
+            50,
+            executor
+        )
+
+        # Trial Evolution
+        trial_store = load_trials(filepath)
+        trial_generations = trial_store["generation"]
+
+        # the initial population is generation -1, so comes first
+        trials = [trial_store["par_vec"][trial_generations == g, :10] for g in np.unique(trial_generations)]
+
+        animate(
+            "trial_evolution",
+            "population",
+            [f"Generation {generation}" for generation in range(len(trials))],
+            trials,
+            50,
+            executor
+        )
+
+        # Best Evolution - the latest 50 bests, most recent first
+        animate(
+            "best_evolution",
+            "best",
+            [f"Best at generation {generation}" for generation in range(len(populations))],
+            [populations[max(0, generation - 49):generation + 1, 0][::-1] for generation in range(len(populations))],
+            200,
+            executor
+        )
+
+if __name__ == "__main__":
+    main()
@@ -10,12 +10,33 @@ class DESolver(DifferentialEvolutionSolver):
 class SmileiWrapper:
     pass
 
+class CheckpointLog:
+    pass
+
+class HistoryIndex:
+    pass
+
+class ResultCache:
+    pass
+
+class TrialStore:
+    pass
+
+class MetricsPublisher:
+    pass
+
+class PhaseTimings:
+    pass
+
+class GaussianProcess:
+    pass
+
 def load_result_from_file():
     pass
 
 class StubUnpickler(pickle.Unpickler):
     def find_class(self, module, name):
-        if module == "desolver" or module == "smilei_wrapper" or module == "goal_functions":
+        if module in ("desolver", "smilei_wrapper", "goal_functions", "checkpoint", "cache", "trial_store", "metrics", "surrogate"):
             module = __name__
         return super().find_class(module, name)
 
@@ -1,10 +1,53 @@
-import matplotlib.pyplot as plt
+import glob
+import hashlib
+import json
+import math
 import numpy as np
+import os
 
 from dataclasses import dataclass
+from functools import lru_cache
 from scipy.constants import pi
-from scipy.fft import fftshift, ifft
-from typing import List, Optional
+from scipy.fft import fftshift, irfft, next_fast_len
+from typing import Callable, List, Optional, Tuple, Union
+
+# a directory holding computed pulses, used when a ChirpedLaser is not given one
+CACHE_ENV = "CUSTOM_LASERS_CACHE"
+
+# exp(-x) underflows to zero beyond this
+_EXP_UNDERFLOW = -np.log(np.finfo(np.float64).tiny)
+
+def _half_spectrum(omega_0: float, tau: float, beta, omega_max: float, samples: int) -> np.ndarray:
+    """
+    The non-negative frequency half of a chirped Gaussian spectrum on a grid of samples points
+    between 0 and omega_max
+
+    The Gaussian is only evaluated in the band around omega_0 where it does not underflow, so the
+    cost of building the spectrum is independent of the grid size.
+    """
+    step = omega_max / (samples - 1)
+    half_width = 2 * np.sqrt(_EXP_UNDERFLOW) / tau
+    lower = max(0, int(np.floor((omega_0 - half_width) / step)))
+    upper = min(samples // 2 + 1, int(np.ceil((omega_0 + half_width) / step)) + 1)
+
+    omega_prime = np.arange(lower, upper) * step - omega_0
+
+    exponent = -1./4. * omega_prime**2 * tau**2 + 0.j
+    for n, beta in enumerate(beta):
+        if beta == 0.:
+            continue
+        exponent -= 1.j * beta / math.factorial(n) * omega_prime**n
+
+    E_omega = np.zeros(samples // 2 + 1, dtype=np.complex128)
+    E_omega[lower:upper] = tau / np.sqrt(2) * np.exp(exponent)
+    return E_omega
+
+@lru_cache(maxsize=None)
+def _unchirped_peak(omega_0: float, tau: float, omega_max: float, samples: int) -> float:
+    """
+    The peak field of the unchirped pulse on a given grid, used to normalise chirped pulses to a_0
+    """
+    return np.max(irfft(_half_spectrum(omega_0, tau, (), omega_max, samples), samples))
 
 @dataclass
 class ChirpedLaser(object):
@@ -16,6 +59,10 @@ class ChirpedLaser(object):
     E_t: Optional[np.ndarray] = None
     t_0: Optional[int] = None
     t_end: Optional[int] = None
+    samples: Optional[int] = None
+    adaptive: bool = False
+    tolerance: float = 1e-3
+    cache_dir: Optional[str] = None
 
     def __post_init__(self):
         if self.beta is not None:
@@ -24,30 +71,129 @@ class ChirpedLaser(object):
     def initialise(self, *beta: List[float], timestep_si=None):
         self.beta = beta
 
-        omega_max = 2**10 * self.omega_0
-        omega = np.linspace(0, omega_max, 2**24, dtype=np.complex128)
-        omega_prime = omega - self.omega_0
-        exponent = -1./4. * omega_prime**2 * self.tau**2
+        (omega_max, samples) = self._grid()
+        self.samples = samples
+
+        if (cache_dir := self.cache_dir or os.environ.get(CACHE_ENV)) is not None:
+            cache_path = os.path.join(cache_dir, self._cache_key(omega_max, samples))
+            if self._load(cache_path):
+                return
+
+        # The spectrum is one sided, and only the real part of the field is used, so the inverse
+        # real FFT of the non-negative frequencies gives the field (up to a factor of 2, which
+        # cancels in the normalisation) at half the memory of a full complex transform
+        E_t = fftshift(irfft(_half_spectrum(self.omega_0, self.tau, beta, omega_max, samples), samples))
+        E_t *= self.a_0 / _unchirped_peak(self.omega_0, self.tau, omega_max, samples)
+
+        # the frequency step is omega_max / (samples - 1), so the time step is not quite 2 pi / omega_max
+        self.dt = 2 * pi * (samples - 1) / (samples * omega_max)
+
+        occupied = np.flatnonzero(np.abs(E_t) > 1e-2)
+        self.t_0 = occupied[-1]
+        self.t_end = occupied[0]
+
+        # copy so the full grid can be freed
+        self.E_t = E_t[self.t_0 : self.t_end : -1].copy()
+
+        if cache_dir is not None:
+            self._store(cache_path)
+
+    def _cache_key(self, omega_max: float, samples: int) -> str:
+        key = repr((
+            float(self.omega_0),
+            float(self.tau),
+            float(self.a_0),
+            tuple(float(beta) for beta in self.beta),
+            float(omega_max),
+            int(samples)
+        ))
+        return hashlib.sha256(key.encode()).hexdigest()
+
+    def _load(self, cache_path: str) -> bool:
+        """
+        Load a previously computed pulse, returning False if there isn't one
+
+        The field is memory-mapped read-only, so simulations on the same node share its pages.
+        """
+        try:
+            # the metadata is always written before the field, so finding the field means both exist
+            self.E_t = np.load(f"{cache_path}.npy", mmap_mode="r")
+        except FileNotFoundError:
+            return False
+
+        with open(f"{cache_path}.json") as metadata_file:
+            metadata = json.load(metadata_file)
+
+        self.dt = metadata["dt"]
+        self.t_0 = metadata["t_0"]
+        self.t_end = metadata["t_end"]
+        return True
+
+    def _store(self, cache_path: str):
+        """
+        Save the computed pulse, renaming each file into place so readers never see a partial entry
+        """
+        os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+        suffix = f"{os.getpid()}.tmp"
+
+        with open(f"{cache_path}.json.{suffix}", "w") as metadata_file:
+            json.dump({"dt": self.dt, "t_0": int(self.t_0), "t_end": int(self.t_end)}, metadata_file)
+        os.replace(f"{cache_path}.json.{suffix}", f"{cache_path}.json")
+
+        with open(f"{cache_path}.npy.{suffix}", "wb") as field_file:
+            np.save(field_file, self.E_t, allow_pickle=False)
+        os.replace(f"{cache_path}.npy.{suffix}", f"{cache_path}.npy")
+
+    def _grid(self) -> Tuple[float, int]:
+        """
+        The highest frequency and number of samples of the FFT grid
+
+        The fixed grid spans 2**10 * omega_0 with 2**24 samples. When adaptive, the grid is sized
+        from the pulse instead: the time step is chosen so that linear interpolation between
+        samples is accurate to within tolerance * a_0, and the time window is chosen to hold the
+        pulse after it has been stretched by the largest group delay across its bandwidth, with
+        the same again as a margin so the periodic transform does not wrap.
+        """
+        if not self.adaptive:
+            return 2**10 * self.omega_0, 2**24
+
+        # half the error budget goes on sampling, the rest covers normalising to the sampled peak
+        log_tolerance = -np.log(self.tolerance)
+        half_width = 2 * np.sqrt(log_tolerance) / self.tau
+        omega_max = 2 * pi * (self.omega_0 + half_width) / np.sqrt(4 * self.tolerance)
+
+        group_delay = sum(
+            abs(beta) / math.factorial(n - 1) * half_width**(n - 1)
+            for n, beta in enumerate(self.beta) if n > 0
+        )
+        window = 4 * (group_delay + self.tau * np.sqrt(log_tolerance))
 
-        E_omega_g = self.tau / np.sqrt(2) * np.exp(exponent)
-        E_t_g = fftshift(ifft(E_omega_g))
-        scale = self.a_0 / np.max(np.real(E_t_g))
+        return omega_max, next_fast_len(int(np.ceil(omega_max * window / (2 * pi))) + 1, real=True)
 
-        for n, beta in enumerate(beta):
-            if beta == 0.:
-                continue
-            exponent -= 1.j * beta / np.math.factorial(n) * omega_prime**n
-        E_omega = self.tau / np.sqrt(2) * np.exp(exponent)
+    def times(self) -> np.ndarray:
+        """
+        The time of each sample of E_t relative to the peak of the unchirped pulse
+        """
+        return (np.arange(len(self.E_t)) - (self.t_0 - self.samples // 2)) * self.dt
 
-        E_t = scale * np.real(fftshift(ifft(E_omega)))
+    def fixed_grid_error(self) -> float:
+        """
+        Compare this pulse with the same pulse built on the fixed grid
 
-        self.dt = 2 * pi / omega_max
+        This pulse is linearly interpolated onto the fixed grid's samples where the two overlap.
 
-        t_0 = len(E_t) - next(i for i, E in enumerate(E_t[::-1]) if np.abs(E) > 1e-2) - 1
-        t_end = next(i for i, E in enumerate(E_t) if np.abs(E) > 1e-2)
+        Returns:
+        The largest difference between the two, relative to a_0
+        """
+        reference = ChirpedLaser(self.omega_0, self.tau, self.a_0, list(self.beta))
+
+        t = self.times()
+        t_reference = reference.times()
+        overlap = (t_reference >= t[0]) & (t_reference <= t[-1])
+
+        E_t = np.interp(t_reference[overlap], t, self.E_t)
+        return np.max(np.abs(E_t - reference.E_t[overlap])) / self.a_0
 
-        self.E_t = E_t[t_0 : t_end : -1]
-    
     def at_sim_time(self, t: float) -> float:
         index = int(t / self.omega_0 / self.dt)
         try:
@@ -55,10 +201,55 @@ class ChirpedLaser(object):
         except IndexError:
             return 0.
 
+    def tabulate(self, timestep: float, oversampling: int = 2) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Resample the field onto a uniform grid in simulation time, by linear interpolation
+
+        Arguments:
+        timestep -- the simulation timestep, in units of 1 / omega_0
+        oversampling -- the number of samples per timestep, so Smilei's evaluations between
+            timesteps land close to a sample
+
+        Returns:
+        The sample times, in units of 1 / omega_0, and the field at each
+        """
+        step = timestep / oversampling
+        times = np.arange(int(np.ceil(len(self.E_t) * self.dt * self.omega_0 / step)) + 1) * step
+        E_t = np.interp(times / self.omega_0, np.arange(len(self.E_t)) * self.dt, self.E_t, right=0.)
+        return times, E_t
+
+    def time_profile(self, timestep: float, oversampling: int = 2) -> Callable[[Union[float, np.ndarray]], Union[float, np.ndarray]]:
+        """
+        A time profile for Smilei's Laser(space_time_profile=...), tabulated once on the simulation
+        time grid and linearly interpolated
+
+        This replaces lambda t: laser.at_sim_time(t). The profile accepts either a single time or a
+        NumPy array of times, in units of 1 / omega_0, and is zero outside the pulse.
+        """
+        (_, E_t) = self.tabulate(timestep, oversampling)
+        samples = E_t.tolist()  # indexing a list from Python is much cheaper than indexing an array
+        last = len(samples) - 1
+        nodes = np.arange(len(samples))
+        inverse_step = oversampling / timestep
+
+        def profile(t):
+            if isinstance(t, np.ndarray):
+                return np.interp(t * inverse_step, nodes, E_t, left=0., right=0.)
+            x = t * inverse_step
+            if 0. <= x < last:
+                i = int(x)
+                E = samples[i]
+                return E + (x - i) * (samples[i + 1] - E)
+            return 0.
+
+        return profile
+
     def get_peak_offset(self) -> float:
         return np.argmax(self.E_t) * self.dt
 
     def plot(self, with_carrier: bool, with_envelope: bool):
+        import matplotlib.pyplot as plt # imported here as namelists never plot
+
         time = (np.arange(len(self.E_t)) - len(self.E_t) / 2) * self.dt
         plt.plot(time, self.E_t)
         if with_carrier:
@@ -66,3 +257,84 @@ class ChirpedLaser(object):
         if with_envelope:
             plt.plot(time, self.a_0 * np.exp(-time**2/self.tau**2))
         plt.show()
+
+
+class ScreenMaxEnergy:
+    """
+    Tracks the highest kinetic energy of the particles crossing a plane screen as the simulation
+    runs, so the screen's spectrum only needs coarse bins
+
+    Pass an instance as the deposited_quantity of a DiagScreen facing forwards along x. Smilei calls
+    it with the particles of the screen's species and only deposits for those which crossed, so the
+    crossing test is repeated here, with each particle's previous position found from its velocity.
+    No particle moves further than a timestep in a step, so only those that close to the screen have
+    their momenta read. The weight is returned, so the screen still records its own spectrum.
+
+    Each MPI rank only sees its own patches, so whenever its maximum rises it is written to a file
+    of its own, which last_bin() combines once the simulation has finished.
+    """
+    def __init__(self, position: float, timestep: float, mass: float, energy_max: float, rank: int, prefix: str = "screen_max"):
+        """
+        Arguments:
+        position -- the screen's position along x
+        timestep -- the simulation timestep
+        mass -- the mass of the screen's species, in units of m_e
+        energy_max -- the top of the screen's ekin axis, in units of m_e c^2. Like the screen,
+            energies beyond this are ignored
+        rank -- the MPI rank, smilei_mpi_rank in a namelist
+        prefix -- the start of the name of each rank's file, {prefix}.{rank}.npy
+        """
+        self.position = position
+        self.timestep = timestep
+        self.mass = mass
+        self.energy_max = energy_max
+        self.prefix = prefix
+        self.path = f"{prefix}.{rank}.npy"
+        self.maximum = 0.
+
+    def __call__(self, particles) -> np.ndarray:
+        side = particles.x - self.position
+
+        if (near := np.flatnonzero((side >= 0.) & (side < self.timestep))).size:
+            # momenta are in units of the species' mass
+            (px, py, pz) = (particles.px[near], particles.py[near], particles.pz[near])
+            gamma = np.sqrt(1. + px**2 + py**2 + pz**2)
+            crossed = side[near] < self.timestep * px / gamma
+
+            ekin = self.mass * (gamma[crossed] - 1.)
+            if (ekin := ekin[ekin < self.energy_max]).size and (maximum := float(ekin.max())) > self.maximum:
+                self.maximum = maximum
+
+                # write then rename, so last_bin() never reads a partial file
+                with open(f"{self.path}.tmp", "wb") as f:
+                    np.save(f, maximum)
+                os.replace(f"{self.path}.tmp", self.path)
+
+        return particles.weight
+
+    def last_bin(self, spectrum: np.ndarray, energy_bins: int) -> Optional[int]:
+        """
+        The last occupied bin of the spectrum the screen would have recorded with energy_bins bins
+
+        The coarse spectrum, which Smilei sums over every rank, is the authority on which bins are
+        occupied, and the highest maximum of any rank places the last particle within its last
+        occupied bin. Should the two disagree, as rounding can at the edge of a bin, the nearest
+        fine bin within the coarse one is used.
+
+        Arguments:
+        spectrum -- the spectrum recorded by the screen, whose number of bins divides energy_bins
+        energy_bins -- the number of bins of the fine spectrum
+
+        Returns:
+        The index of the fine bin, or None if no particle crossed the screen
+        """
+        if not (occupied := np.flatnonzero(spectrum)).size:
+            return None
+
+        ratio = energy_bins // len(spectrum)
+        lower = int(occupied[-1]) * ratio
+
+        maximum = max((float(np.load(path)) for path in glob.glob(f"{self.prefix}.*.npy")), default=0.)
+        index = int(maximum / self.energy_max * energy_bins)
+
+        return min(max(index, lower), lower + ratio - 1)
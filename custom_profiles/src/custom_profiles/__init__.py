@@ -0,0 +1,65 @@
+import numpy as np
+
+from typing import Callable, Union
+
+Profile = Callable[[Union[float, np.ndarray]], Union[float, np.ndarray]]
+
+def _vectorised(profile: Callable[[np.ndarray], np.ndarray]) -> Profile:
+    """
+    Wrap a profile written for arrays so it also accepts a single position
+
+    Smilei evaluates a profile that accepts NumPy arrays once per patch with every cell position,
+    rather than once per cell, so the cost of initialisation and load balancing no longer scales
+    with the number of Python calls. A single position gives a NumPy float, which Smilei reads as a
+    float.
+    """
+    def wrapped(x):
+        return profile(np.asarray(x, dtype=np.float64))[()]
+
+    return wrapped
+
+def exponential_ramp(peak: float, start: float, thickness: float, scale_length: float) -> Profile:
+    """
+    An exponential ramp up to a plateau, followed by vacuum
+
+    Arguments:
+    peak -- the density of the plateau
+    start -- the position at which the ramp ends and the plateau begins
+    thickness -- the length of the plateau
+    scale_length -- the distance over which the ramp's density falls by a factor of e
+
+    Returns:
+    A profile for Smilei's Species(number_density=...)
+    """
+    def profile(x: np.ndarray) -> np.ndarray:
+        # the ramp is only kept before the plateau, so clip to avoid overflow beyond it
+        density = peak * np.exp(np.minimum(x - start, 0.) / scale_length)
+        return np.where(x < start + thickness, density, 0.)
+
+    return _vectorised(profile)
+
+def piecewise_constant(densities: Union[np.ndarray, Callable[[], np.ndarray]], start: float, thickness: float) -> Profile:
+    """
+    A slab divided into equal-width layers of constant density, surrounded by vacuum
+
+    Arguments:
+    densities -- the density of each layer, in order of increasing x, or a function returning them
+        each time the profile is evaluated, so a namelist can load them in preprocess()
+    start -- the position at which the slab begins
+    thickness -- the length of the slab
+
+    Returns:
+    A profile for Smilei's Species(number_density=...)
+    """
+    def profile(x: np.ndarray) -> np.ndarray:
+        layer_densities = np.append(np.asarray(densities() if callable(densities) else densities, dtype=np.float64), 0.)
+        layers = len(layer_densities) - 1
+
+        rel = x - start
+        inside = (rel >= 0) & (rel < thickness)
+        # rounding can put the last position inside the slab one layer too far
+        index = np.minimum(np.floor(rel * layers / thickness), layers - 1)
+        # positions outside the slab index the trailing vacuum layer
+        return layer_densities[np.where(inside, index, layers).astype(np.intp)]
+
+    return _vectorised(profile)
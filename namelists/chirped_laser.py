@@ -87,7 +87,7 @@ LoadBalancing(
 
 Laser(
     box_side = "xmin",
-    space_time_profile = [ lambda t: 0., lambda t: laser.at_sim_time(t) ]
+    space_time_profile = [ lambda t: 0., laser.time_profile(timestep) ]
 )
 
 number_density = trapezoidal(density, xvacuum=box_front, xplateau=thickness)
@@ -1,6 +1,7 @@
 import numpy as np
 
 from custom_lasers import ChirpedLaser
+from custom_profiles import exponential_ramp
 from scipy.constants import c, e, m_e, pi
 
 # Laser properties
@@ -90,16 +91,10 @@ LoadBalancing(
 
 Laser(
     box_side = "xmin",
-    space_time_profile = [ lambda t: 0., lambda t: laser.at_sim_time(t) ]
+    space_time_profile = [ lambda t: 0., laser.time_profile(timestep) ]
 )
 
-def number_density(x):
-    if x < box_front:
-        return peak_density * np.exp((x - box_front) / scale_length)
-    elif x < box_front + thickness:
-        return peak_density
-    else:
-        return 0
+number_density = exponential_ramp(peak_density, box_front, thickness, scale_length)
 
 Species(
     name = "electrons",
@@ -1,8 +1,13 @@
 import numpy as np
+import os
 
-from custom_lasers import ChirpedLaser
+from custom_lasers import ChirpedLaser, ScreenMaxEnergy
+from custom_profiles import exponential_ramp
 from scipy.constants import c, e, m_e, pi
 
+# below 1 when the supervisor screens a trial cheaply (see --fidelity), coarsening the resolution
+fidelity = float(np.load("fidelity.npy")) if os.path.exists("fidelity.npy") else 1.
+
 # Laser properties
 wavelength_si = 800.e-9 # m
 fwhm_si = 30.e-15 # s
@@ -12,6 +17,7 @@ focal_spot_si = 3.e-6 # m
 # Plasma properties
 energy_max_mev = 30e6 # eV
 energy_bins = 10000000
+screen_bins = 1000 # the bins of the screen, energy_bins only sets the resolution of the result
 peak_density = 0.25
 thickness_si = 1.5e-5
 scale_length_si = 5.e-6
@@ -19,7 +25,7 @@ scale_length_si = 5.e-6
 # Simulation Properties
 box_front_si = 15e-6
 box_back_si = 10e-6
-particles_per_cell = 64
+particles_per_cell = max(1, round(64 * fidelity))
 boundary_conditions = [["remove", "remove"]]
 simulation_time_si = 1e-12 # s
 number_of_patches = [32]
@@ -46,7 +52,7 @@ momentum_max = momentum_max_si / (m_e * c)
 lambda_p = np.sqrt(2)
 
 # Computed Simulation Properties
-cell_length = [0.05 * lambda_p]
+cell_length = [0.05 * lambda_p / fidelity]
 box_front = box_front_si * omega_si / c
 box_back = box_back_si * omega_si / c
 number_of_cells = [np.ceil(((box_front + thickness + box_back) / cell_length[0]) / number_of_patches[0]) * number_of_patches[0]]
@@ -54,35 +60,32 @@ screen_position = box_front + thickness + box_back
 timestep = 0.99 * cell_length[0]
 number_of_timesteps = int(np.ceil(((simulation_time_si + laser.get_peak_offset()) * omega_si) / timestep))
 diag_every = int(10.e-15 * omega_si / timestep)
+screen_max = ScreenMaxEnergy(screen_position, timestep, 1836., energy_max, smilei_mpi_rank)
 
 def preprocess():
-    import os
-    import tempfile
-    global results_dir
-    results_dir = os.getcwd()
-    work_dir = tempfile.mkdtemp(dir=os.environ["TMPDIR"])
-    os.chdir(work_dir)
+    # lets the supervisor tell how far through the run a dump is when pruning
+    if smilei_mpi_rank == 0:
+        np.save("number_of_timesteps.npy", number_of_timesteps)
 
 def analysis():
     import os
     import pickle
-    import shutil
     from h5py import File # use h5py to avoid reimporting the namelist and regenerating laser
 
     with File("Screen0.h5") as f:
-        data = np.array(f[f"timestep{number_of_timesteps - 1:0>8d}"])
+        spectrum = np.array(f[f"timestep{number_of_timesteps - 1:0>8d}"])
 
-    try:
-        index = np.nonzero(data)[0][-1] + 1
-    except IndexError:
+    if (index := screen_max.last_bin(spectrum, energy_bins)) is None:
         index = 0
+    else:
+        index += 1
     
     result = index / energy_bins * energy_max_mev
 
-    with open(f"{results_dir}/result", "wb") as f:
+    # write then rename, so the supervisor never reads a partial result
+    with open("result.tmp", "wb") as f:
         pickle.dump(-result, f)
-
-    shutil.rmtree(os.getcwd())
+    os.replace("result.tmp", "result")
 
 Main(
     geometry = "1Dcartesian",
@@ -108,16 +111,10 @@ LoadBalancing(
 
 Laser(
     box_side = "xmin",
-    space_time_profile = [ lambda t: 0., lambda t: laser.at_sim_time(t) ]
+    space_time_profile = [ lambda t: 0., laser.time_profile(timestep) ]
 )
 
-def number_density(x):
-    if x < box_front:
-        return peak_density * np.exp((x - box_front) / scale_length)
-    elif x < box_front + thickness:
-        return peak_density
-    else:
-        return 0
+number_density = exponential_ramp(peak_density, box_front, thickness, scale_length)
 
 Species(
     name = "electrons",
@@ -143,15 +140,17 @@ Species(
     boundary_conditions = boundary_conditions
 )
 
+# dumped every diag_every, ending on the final timestep, so the supervisor can prune a hopeless
+# simulation while it runs
 DiagScreen(
     shape = "plane",
     point = [screen_position],
     vector = [1.],
     direction = "forward",
-    deposited_quantity = "weight",
+    deposited_quantity = screen_max,
     species = ["protons"],
     axes = [
-        ["ekin", 0., energy_max, energy_bins]
+        ["ekin", 0., energy_max, screen_bins]
     ],
-    every = number_of_timesteps - 1
+    every = [(number_of_timesteps - 1) % diag_every, diag_every]
 )
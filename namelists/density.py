@@ -1,6 +1,7 @@
 import numpy as np
 
-from numpy import ceil, floor, log, sqrt
+from custom_profiles import piecewise_constant
+from numpy import ceil, log, sqrt
 from scipy.constants import c, e, m_e, pi
 
 # Laser properties
@@ -41,6 +42,8 @@ diag_every = number_of_timesteps / 100
 
 density_map = np.array([])
 
+# happi re-executes the namelist wherever the results are opened, where par_vec.npy may be absent,
+# so it is only read once Smilei is about to run
 def preprocess():
     with open("par_vec.npy", 'rb') as d_map_file:
         global density_map
@@ -77,11 +80,7 @@ LaserPlanar1D(
     time_envelope = tgaussian(fwhm=fwhm, start=0., center=laser_t0)
 )
 
-def number_density(x):
-    if (rel := x - thickness * 3.5) >= 0 and rel < thickness:
-        return density_map[int(floor(rel * len(density_map) / thickness))]
-    else:
-        return 0.
+number_density = piecewise_constant(lambda: density_map, 3.5 * thickness, thickness)
 
 Species(
     name = "electrons",
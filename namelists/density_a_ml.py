@@ -1,13 +1,14 @@
-import happi
 import numpy as np
 import os
 import pickle
-import shutil
-import tempfile
 
-from numpy import ceil, floor, log, sqrt
+from custom_profiles import piecewise_constant
+from numpy import ceil, log, sqrt
 from scipy.constants import c, m_e, pi
 
+# below 1 when the supervisor screens a trial cheaply (see --fidelity), coarsening the resolution
+fidelity = float(np.load("fidelity.npy")) if os.path.exists("fidelity.npy") else 1.
+
 # Laser properties
 wavelength_si = 800.e-9 # m
 fwhm_si = 30.e-15 # s
@@ -23,9 +24,9 @@ laser_t0 = fwhm / sqrt(log(2)) # time when peak of laser enters box
 # Plasma properties
 n_0 = 2. # relative to n_crit
 lambda_p = sqrt(n_0)
-cell_length = [0.05 * lambda_p] # calculate plasma wavelength and resolve much smaller (lambda_p / 50)
+cell_length = [0.05 * lambda_p / fidelity] # calculate plasma wavelength and resolve much smaller (lambda_p / 50)
 number_of_patches = [32]
-particles_per_cell = 64
+particles_per_cell = max(1, round(64 * fidelity))
 thickness_si = 5.e-6 # m
 thickness = thickness_si * omega_si / c
 number_of_cells = [ceil((8 * thickness / cell_length[0]) / number_of_patches[0]) * number_of_patches[0]]
@@ -36,24 +37,32 @@ simulation_time_si = 1e-12 # s
 cfl_condition = cell_length[0] # 1 / sqrt(sum([1./l**2 for l in Main.cell_length]))
 timestep = 0.99 * cfl_condition
 number_of_timesteps = int(ceil((simulation_time_si * omega_si) / timestep))
-diag_every = number_of_timesteps
+diag_every = int(number_of_timesteps / 100)
 
-results_dir = os.getcwd()
 density_map = np.array([])
 
+# happi re-executes the namelist wherever the results are opened, where par_vec.npy may be absent,
+# so it is only read once Smilei is about to run
 def preprocess():
     with open("par_vec.npy", 'rb') as d_map_file:
         global density_map
         density_map = np.load(d_map_file, allow_pickle=False)
-    work_dir = tempfile.mkdtemp(dir=os.environ["TMPDIR"])
-    os.chdir(work_dir)
+
+    # lets the supervisor tell how far through the run a dump is when pruning
+    if smilei_mpi_rank == 0:
+        np.save("number_of_timesteps.npy", number_of_timesteps)
 
 def analysis():
-    sim_results = happi.Open()
-    result = -sim_results.Screen(0).getData()[-1]
-    shutil.rmtree(os.getcwd())
-    with open(f"{results_dir}/result", "wb") as result_file:
+    from h5py import File # use h5py to avoid re-executing the namelist
+
+    # the screen is dumped periodically, so read the final timestep by name
+    with File("Screen0.h5") as f:
+        result = -float(np.squeeze(f[f"timestep{number_of_timesteps:0>8d}"][()]))
+
+    # write then rename, so the supervisor never reads a partial result
+    with open("result.tmp", "wb") as result_file:
         pickle.dump(result, result_file)
+    os.replace("result.tmp", "result")
 
 Main(
     geometry = "1Dcartesian",
@@ -86,11 +95,7 @@ LaserPlanar1D(
     time_envelope = tgaussian(fwhm=fwhm, start=0., center=laser_t0)
 )
 
-def number_density(x):
-    if (rel := x - thickness * 3.5) >= 0 and rel < thickness:
-        return density_map[int(floor(rel * len(density_map) / thickness))]
-    else:
-        return 0.
+number_density = piecewise_constant(lambda: density_map, 3.5 * thickness, thickness)
 
 Species(
     name = "electrons",
@@ -124,5 +129,6 @@ DiagScreen(
     deposited_quantity = "weight_ekin",
     species = ["protons"],
     axes = [],
-    every = diag_every
+    # ending on the final timestep, so the supervisor can prune a hopeless simulation while it runs
+    every = [number_of_timesteps % diag_every, diag_every]
 )
@@ -36,14 +36,20 @@ for i in range(u_size - 1):
         info=info
     ))
 
-recvs = [(i, comm.irecv(source=0, tag=0)) for (i, comm) in enumerate(comms)]
-while len(recvs) != 0:
-    for item in recvs:
-        i, recv = item
-        if recv.Test():
-            recv.Wait()
+# smilei_sub joins a barrier with its parent on exit. Test every outstanding barrier at once,
+# backing off while nothing completes so this rank stays idle while the simulations run
+reqs = [comm.Ibarrier() for comm in comms]
+remaining = len(reqs)
+wait = 0.001
+while remaining != 0:
+    if (completed := MPI.Request.Testsome(reqs)):
+        for i in completed:
             print(f"Process {i} completed")
-            recvs.remove(item)
-    time.sleep(3)
+            comms[i].Disconnect()
+        remaining -= len(completed)
+        wait = 0.001
+    else:
+        time.sleep(wait)
+        wait = min(2 * wait, 1.)
 
 print("No Smilei tasks are running, exiting...")
@@ -0,0 +1,61 @@
+import hashlib
+import numpy as np
+import os
+import pathlib
+import pickle
+import threading
+
+from typing import Optional
+
+class ResultCache:
+    """
+    A persistent store of goal values, keyed on a quantised parameter vector
+
+    Entries are grouped by a hash of the namelist and the name of the goal function, so a cache
+    directory can be shared by every job that uses the same namelist. Each entry is a single small
+    file which is written to a temporary name and renamed into place, so concurrent jobs never see
+    a partial entry and nothing is lost if a job is killed.
+    """
+    def __init__(self, directory: pathlib.Path, namelist: pathlib.Path, goal: str, digits: int = 6):
+        """
+        Arguments:
+        directory -- where to keep the cache, created if necessary
+        namelist -- path to the namelist, whose contents are hashed
+        goal -- the name of the goal function
+        digits -- the number of significant figures kept when quantising parameters; trial vectors
+            equal to this precision share an entry
+        """
+        with open(namelist, "rb") as namelist_file:
+            namelist_hash = hashlib.sha256(namelist_file.read()).hexdigest()
+
+        self.directory = directory / f"{namelist_hash[:16]}-{goal}"
+        self.digits = digits
+
+        self.directory.mkdir(parents=True, exist_ok=True)
+
+    def _path(self, par_vec: np.ndarray) -> pathlib.Path:
+        # adding 0. maps -0. onto 0.
+        quantised = ",".join(f"{x + 0.:.{self.digits - 1}e}" for x in par_vec)
+        return self.directory / hashlib.sha256(quantised.encode()).hexdigest()
+
+    def get(self, par_vec: np.ndarray) -> Optional[float]:
+        """
+        Look up the stored result for par_vec, returning None on a miss
+        """
+        try:
+            with open(self._path(par_vec), "rb") as entry:
+                return pickle.load(entry)
+        except FileNotFoundError:
+            return None
+
+    def put(self, par_vec: np.ndarray, result: float):
+        """
+        Store the result for par_vec
+        """
+        path = self._path(par_vec)
+        tmp_path = path.with_name(f"{path.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+
+        with open(tmp_path, "wb") as entry:
+            pickle.dump(result, entry)
+
+        os.replace(tmp_path, path)
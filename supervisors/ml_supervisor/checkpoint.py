@@ -0,0 +1,187 @@
+import json
+import logging
+import numpy as np
+import os
+import pathlib
+import pickle
+import struct
+import threading
+import zlib
+
+from typing import Iterator, Tuple
+
+# each record is a little-endian payload length and CRC-32, followed by the pickled payload
+HEADER = struct.Struct("<QI")
+
+class CheckpointLog:
+    """
+    An append-only log of solver checkpoints
+
+    The full solver is only pickled once, to solverinit.pickle. After that each generation appends
+    a record holding the population members that changed, along with the RNG state and counters,
+    and each completed trial appends a small record of its own, so a walltime kill loses at most
+    the simulations still in flight. Records are fsynced as they are written and carry a checksum,
+    so a record torn by a kill is detected and ignored along with anything after it.
+    """
+    def __init__(self, path: pathlib.Path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.log_file = None
+        self.end = None
+
+    def append(self, record: dict):
+        """
+        Append a record and flush it to disk
+        """
+        payload = pickle.dumps(record, protocol=pickle.HIGHEST_PROTOCOL)
+
+        with self.lock:
+            if self.log_file is None:
+                # drop any torn record left by a kill, so new records are not written after it
+                if (end := self.end) is None:
+                    end = 0
+                    for (end, _) in self.scan():
+                        pass
+
+                self.log_file = open(self.path, "ab")
+                self.log_file.truncate(end)
+                self.end = None
+
+            self.log_file.write(HEADER.pack(len(payload), zlib.crc32(payload)) + payload)
+            self.log_file.flush()
+            os.fsync(self.log_file.fileno())
+
+    def records(self) -> Iterator[dict]:
+        """
+        Read back every complete record, in the order they were written
+        """
+        for (_, record) in self.scan():
+            yield record
+
+    def truncate(self, end: int):
+        """
+        Discard every record after offset end before the next record is appended, so a run resumed
+        at an earlier generation does not leave the later generations in the log after its own
+        """
+        with self.lock:
+            self.end = end
+
+            if self.log_file is not None:
+                self.log_file.truncate(end)
+
+    def scan(self) -> Iterator[Tuple[int, dict]]:
+        """
+        Read back every complete record, along with the offset at which it ends
+        """
+        logger = logging.getLogger("supervisor")
+
+        try:
+            log_file = open(self.path, "rb")
+        except FileNotFoundError:
+            return
+
+        with log_file:
+            while len(header := log_file.read(HEADER.size)) == HEADER.size:
+                (length, crc) = HEADER.unpack(header)
+                payload = log_file.read(length)
+
+                if len(payload) != length or zlib.crc32(payload) != crc:
+                    logger.warning(f"Ignoring torn record at the end of {self.path}")
+                    return
+
+                yield log_file.tell(), pickle.loads(payload)
+
+    def close(self):
+        with self.lock:
+            if self.log_file is not None:
+                self.log_file.close()
+                self.log_file = None
+
+    def __getstate__(self):
+        return {"path": self.path}
+
+    def __setstate__(self, state):
+        self.__init__(state["path"])
+
+
+class HistoryIndex:
+    """
+    A compact record of the population at the end of every generation, for analysis
+
+    The generation number, the scaled population and its energies are appended as raw arrays to
+    one file each, described by header.json, so analysis can memory-map them without unpickling a
+    solver. A generation rerun after resuming at an earlier one is appended again; readers keep the
+    last copy.
+    """
+    def __init__(self, directory: pathlib.Path):
+        self.directory = directory
+        self.files = None
+
+    def append(self, generation: int, population: np.ndarray, energies: np.ndarray):
+        """
+        Append a generation's scaled population, shape (popsize, dims), and its energies
+        """
+        columns = {
+            "generation": np.asarray(generation, dtype=np.int32),
+            "population": np.asarray(population, dtype=np.float64),
+            "population_energies": np.asarray(energies, dtype=np.float64)
+        }
+
+        if self.files is None:
+            self.files = self._open(columns)
+
+        for (name, column) in columns.items():
+            self.files[name].write(column.tobytes())
+            self.files[name].flush()
+
+    def _open(self, columns: dict) -> dict:
+        """
+        Write the header, unless appending to an existing index, and open every column for
+        appending, cut back to the generations which are complete in all of them
+        """
+        self.directory.mkdir(parents=True, exist_ok=True)
+
+        paths = {name: self.directory / f"{name}.bin" for name in columns}
+        rows = min(path.stat().st_size // column.nbytes if path.exists() else 0 for (name, path), column in zip(paths.items(), columns.values()))
+
+        if not (header_path := self.directory / "header.json").exists():
+            header = {
+                "columns": {
+                    name: {"dtype": column.dtype.str, "shape": list(column.shape)}
+                    for (name, column) in columns.items()
+                }
+            }
+
+            with open(header_path, "w") as header_file:
+                json.dump(header, header_file, indent=2)
+
+        files = {name: open(path, "ab") for (name, path) in paths.items()}
+
+        for (name, history_file) in files.items():
+            history_file.truncate(rows * columns[name].nbytes)
+
+        return files
+
+    def clear(self):
+        """
+        Discard every generation recorded so far, along with the header, so a new run does not
+        append to the index of an old one
+        """
+        self.close()
+
+        for path in self.directory.glob("*.bin"):
+            path.unlink()
+
+        (self.directory / "header.json").unlink(missing_ok=True)
+
+    def close(self):
+        if self.files is not None:
+            for history_file in self.files.values():
+                history_file.close()
+            self.files = None
+
+    def __getstate__(self):
+        return {"directory": self.directory}
+
+    def __setstate__(self, state):
+        self.__init__(state["directory"])
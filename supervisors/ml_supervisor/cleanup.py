@@ -0,0 +1,41 @@
+import logging
+import queue
+import shutil
+import threading
+
+class Cleaner:
+    """
+    Deletes work directories from a background thread, so deletes never hold up a simulation
+
+    Failures are logged but otherwise ignored - they are usually due to latency on the HPC's
+    ephemeral store, and a leftover directory does no harm.
+    """
+    def __init__(self, logger_name: str = "supervisor"):
+        self.logger_name = logger_name
+        self.queue = queue.SimpleQueue()
+        self.thread = threading.Thread(target=self._clean, name="cleaner", daemon=True)
+        self.thread.start()
+
+    def remove(self, directory: str):
+        """
+        Queue directory, and everything in it, for deletion
+        """
+        self.queue.put(directory)
+
+    def close(self):
+        """
+        Finish deleting every queued directory
+        """
+        self.queue.put(None)
+        self.thread.join()
+
+    def _clean(self):
+        logger = logging.getLogger(self.logger_name)
+
+        while (directory := self.queue.get()) is not None:
+            shutil.rmtree(
+                directory,
+                onerror=lambda _f, p, e: logger.warning(f"Failed to delete {p} as {e}")
+            )
+
+            logger.debug(f"Removed {directory}")
@@ -1,11 +1,15 @@
 import logging
 import numpy as np
+import pathlib
 import pickle
 
 from scipy.optimize._differentialevolution import DifferentialEvolutionSolver, _MACHEPS
 from scipy._lib._util import MapWrapper
-from concurrent.futures import ThreadPoolExecutor
+from collections import Counter
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
 
+from checkpoint import CheckpointLog, HistoryIndex
+from surrogate import GaussianProcess
 from utils import pp_array
 
 class DESolver(DifferentialEvolutionSolver):
@@ -23,11 +27,23 @@ class DESolver(DifferentialEvolutionSolver):
         atol=0,
         init='latinhypercube',
         seed=None,
-        constraints=()
+        constraints=(),
+        asynchronous=False,
+        surrogate=None
     ):
         self.smilei_wrapper = smilei_wrapper
         self.threads = threads
         self.max_sims = max_sims
+        self.asynchronous = asynchronous
+        self.surrogate = surrogate
+        self.surrogate_model = GaussianProcess()
+        self._observations = ([], [])
+        self.checkpoints = CheckpointLog(pathlib.Path("checkpoint.log"))
+        self.history = HistoryIndex(pathlib.Path("history"))
+        self._checkpointed = None
+        self._reusable = None
+        self._sims_dispatched = 0
+        self._completed = 0
 
         workers = ThreadPoolExecutor(max_workers=threads).map
 
@@ -59,6 +75,10 @@ class DESolver(DifferentialEvolutionSolver):
         logger.info("Preparing initial population")
 
         if np.all(np.isinf(self.population_energies)):
+            # a new run - whatever an earlier run left in this directory would be replayed before it
+            self.checkpoints.truncate(0)
+            self.history.clear()
+
             self.feasible, self.constraint_violation = (
                 self._calculate_population_feasibilities(self.population)
             )
@@ -72,10 +92,17 @@ class DESolver(DifferentialEvolutionSolver):
 
             self._promote_lowest_energy()
 
-        # checkpoint
+        for (member, energy) in zip(self.population, self.population_energies):
+            self._observe(member, energy)
+
+        # checkpoint - the only full copy of the solver, later checkpoints are appended to the log
+        self._checkpointed = (self.population.copy(), self.population_energies.copy())
+
         with open(f"solverinit.pickle", "wb") as pickle_file:
             pickle.dump(self, pickle_file)
 
+        self.history.append(-1, self._scale_parameters(self.population), self.population_energies)
+
         logger.info(f"Initial population complete")
         logger.info(pp_array(self.x))
         logger.info(f"Energy is {-self.population_energies[0]:.3e}, convergence is: {self.tol / (self.convergence + _MACHEPS):.3e}")
@@ -83,8 +110,6 @@ class DESolver(DifferentialEvolutionSolver):
     def optimise(self):
         logger = logging.getLogger("supervisor")
 
-        gens_exhausted = False
-        sims_exhausted = False
         (start_gen, sims_run) = (0, self.num_population_members) if (gen := self.smilei_wrapper.generation) is None else (gen + 1, 0)
 
         if start_gen == 0:
@@ -92,43 +117,561 @@ class DESolver(DifferentialEvolutionSolver):
         else:
             logger.info(f"Resuming optimisation at generation {start_gen}")
 
+        if self.asynchronous:
+            (i, gens_exhausted, sims_exhausted) = self._evolve_asynchronous(start_gen, sims_run, self._completed)
+        else:
+            (i, gens_exhausted, sims_exhausted) = self._evolve_deferred(start_gen, sims_run)
+
+        logger.info("=============================================")
+        logger.info("             Optimisation Result")
+        logger.info(pp_array(self.x))
+        logger.info(f"{-self.population_energies[0]:.3e}")
+        logger.info("=============================================")
+
+        self.checkpoints.close()
+        self.history.close()
+
+        logger.info("Simulation timings (seconds) and resource usage (bytes):")
+        for line in self.smilei_wrapper.timings.report():
+            logger.info(line)
+
+        if gens_exhausted:
+            logger.info(f"Generation limit exhausted after {i} generations")
+        elif sims_exhausted:
+            logger.info(f"Simulation limit exhausted after {i} generations")
+        else:
+            logger.info(f"Optimisation converged after {i} generations!")
+
+    def _calculate_population_energies(self, population):
+        """
+        Calculate the energies of a population of trials, passing each simulation the energy of
+        the population member its trial competes with, so that hopeless trials can be pruned
+
+        If surrogate screening is enabled, only the trials it passes are simulated. The rest are
+        given an infinite energy, so they are rejected, and are logged so a resumed generation
+        does not simulate them either.
+
+        The initial population has no targets, and is handled by SciPy as usual.
+        """
+        if np.size(population, 0) != self.num_population_members or np.all(np.isinf(self.population_energies)):
+            self._sims_dispatched += np.size(population, 0)
+            return super()._calculate_population_energies(population)
+
+        self._fit_surrogate()
+
+        # trials completed before an interruption are always reused, whatever the surrogate thinks
+        reused = np.array([self._reused_energy(trial) is not None for trial in population], dtype=bool)
+        simulate = reused | self._screen(population, self.population_energies)
+
+        energies = np.full(self.num_population_members, np.inf)
+        energies[simulate] = list(self._mapwrapper(lambda args: self._run_trial(*args), zip(np.flatnonzero(simulate), population[simulate])))
+        self._nfev += np.count_nonzero(simulate)
+        self._sims_dispatched += np.count_nonzero(simulate & ~reused)
+
+        for target in np.flatnonzero(~simulate):
+            self.checkpoints.append({
+                "kind": "trial",
+                "generation": self.smilei_wrapper.generation,
+                "target": target,
+                "trial": population[target],
+                "energy": np.inf,
+                "final": True
+            })
+
+        self._publish_screening(self.smilei_wrapper.generation, self.num_population_members, np.count_nonzero(simulate))
+
+        return energies
+
+    def _run_trial(self, target, trial):
+        """
+        Simulate a trial competing with population member target, and log the result
+
+        If the generation was interrupted and this trial completed before the interruption, its
+        result is reused rather than simulated again. Only final results, from simulations which
+        ran in full, are offered to the surrogate or reused.
+        """
+        logger = logging.getLogger("supervisor")
+
+        if (energy := self._reused_energy(trial)) is not None:
+            logger.debug(f"Reusing result: {-energy:.3e}, parameters: {pp_array(self._scale_parameters(trial))}")
+            final = True
+        else:
+            (energy, final) = self.smilei_wrapper.run_trial(self._scale_parameters(trial), self.population_energies[target])
+
+        if final:
+            self._observe(trial, energy)
+
+        self.checkpoints.append({
+            "kind": "trial",
+            "generation": self.smilei_wrapper.generation,
+            "target": target,
+            "trial": trial,
+            "energy": energy,
+            "final": final
+        })
+
+        return energy
+
+    def reuse_trials(self, generation, trials, energies):
+        """
+        Offer the results of trials completed before an interruption to the resumed generation
+
+        The RNG state is checkpointed at generation boundaries, so the resumed generation draws the
+        same trials again. Those which match one of trials are not simulated again.
+
+        Arguments:
+        generation -- the interrupted generation
+        trials -- completed trial vectors, normalised to [0, 1], shape (M, N)
+        energies -- their energies, shape (M,)
+        """
+        logger = logging.getLogger("supervisor")
+
+        logger.info(f"{len(energies)} completed trials are available to generation {generation}")
+
+        self._reusable = (generation, np.atleast_2d(trials), np.asarray(energies))
+
+    def _reused_energy(self, trial):
+        """
+        Look up the energy of a trial completed before an interruption, or None if there is none
+        """
+        if self._reusable is None or self._reusable[0] != self.smilei_wrapper.generation:
+            return None
+
+        (_, trials, energies) = self._reusable
+
+        # allow for the rounding of vectors read back from a generation file
+        if len(matches := np.flatnonzero(np.all(np.isclose(trials, trial, rtol=1e-12, atol=0), axis=1))) == 0:
+            return None
+
+        return energies[matches[0]]
+
+    def _evolve_deferred(self, start_gen, sims_run):
+        """
+        Evolve the population a generation at a time, waiting for every trial in a generation to
+        finish before any are merged
+
+        Returns:
+        The last generation, and whether the generation or simulation limits were exhausted
+        """
+        gens_exhausted = False
+        sims_exhausted = False
+
         for i in range(start_gen, self.maxiter):
             self.smilei_wrapper.generation = i
 
-            if self.max_sims is None or (sims_run := sims_run + self.num_population_members) < self.max_sims:
-                next(self)
-            else:
+            # a generation is only started if it would fit even if none of its trials were screened
+            # out, but only trials handed to the simulation wrapper count against the limit
+            if self.max_sims is not None and sims_run + self.num_population_members >= self.max_sims:
                 sims_exhausted = True
                 break
 
-            # checkpoint
-            with open(f"solver{i:0>3d}.pickle", "wb") as pickle_file:
-                pickle.dump(self, pickle_file)
+            dispatched = self._sims_dispatched
+            next(self)
+            sims_run += self._sims_dispatched - dispatched
+
+            self.checkpoint(i)
 
             if self.converged():
                 break
 
-            logger.info("=============================================")
-            logger.info(f"            Generation {i} complete")
-            logger.info(pp_array(self.x))
-            logger.info(f"Energy is {-self.population_energies[0]:.3e}, convergence is: {self.tol / (self.convergence + _MACHEPS):.3e}")
-            logger.info("=============================================")
+            self._log_generation(i)
         else:
             gens_exhausted = True
 
-        logger.info("=============================================")
-        logger.info("             Optimisation Result")
-        logger.info(pp_array(self.x))
-        logger.info(f"{-self.population_energies[0]:.3e}")
-        logger.info("=============================================")
+        return i, gens_exhausted, sims_exhausted
 
-        if gens_exhausted:
-            logger.info(f"Generation limit exhausted after {i} generations")
-        elif sims_exhausted:
-            logger.info(f"Simulation limit exhausted after {i} generations")
+    def _evolve_asynchronous(self, start_gen, sims_run, completed=0):
+        """
+        Evolve the population without generation barriers
+
+        A new trial is submitted as soon as a simulation slot frees up, and each result is merged
+        into the population as it arrives, in the same way as SciPy's immediate updating. Each
+        target population member has at most one trial in flight. A generation is counted as
+        complete, and checkpointed, after every num_population_members results.
+
+        A generation cut short, by the simulation limit or an interruption, is resumed under its own
+        number with the completed results it already has.
+
+        Returns:
+        The last generation, and whether the generation or simulation limits were exhausted
+        """
+        logger = logging.getLogger("supervisor")
+
+        gens_exhausted = False
+        sims_exhausted = False
+        converged = False
+
+        i = start_gen
+        # targets are visited in turn, so a resumed generation carries on where it was cut short
+        candidate = completed % self.num_population_members
+        (proposed, screened_out) = (0, 0)
+        in_flight = {}  # future -> (target population member, trial)
+
+        if i >= self.maxiter:
+            return i, True, False
+
+        self.smilei_wrapper.generation = i
+        # a resumed generation was dithered before it was cut short, and its scale restored
+        if completed == 0:
+            self._dither()
+        self._fit_surrogate()
+
+        with ThreadPoolExecutor(max_workers=self.threads) as executor:
+            while True:
+                # keep every worker busy, but no busier - a trial waiting for a pool slot is drawn
+                # from a population that will have moved on by the time it runs
+                slots = self.threads if self.smilei_wrapper.slots is None else self.smilei_wrapper.slots
+                while not (gens_exhausted or sims_exhausted or converged) and len(in_flight) < min(slots, self.num_population_members):
+                    if self.max_sims is not None and sims_run >= self.max_sims:
+                        sims_exhausted = True
+                        break
+
+                    targets = {target for (target, _) in in_flight.values()}
+                    while candidate in targets:
+                        candidate = (candidate + 1) % self.num_population_members
+
+                    trial = self._mutate(candidate)
+                    self._ensure_constraint(trial)
+                    proposed += 1
+
+                    if not self._screen(trial[np.newaxis], self.population_energies[[candidate]])[0]:
+                        screened_out += 1
+                        candidate = (candidate + 1) % self.num_population_members
+                        continue
+
+                    future = executor.submit(self.smilei_wrapper.run_trial, self._scale_parameters(trial), self.population_energies[candidate])
+                    in_flight[future] = (candidate, trial)
+                    sims_run += 1
+                    candidate = (candidate + 1) % self.num_population_members
+
+                if not in_flight:
+                    break
+
+                (done, _) = wait(in_flight, return_when=FIRST_COMPLETED)
+
+                for future in done:
+                    (target, trial) = in_flight.pop(future)
+                    (energy, final) = future.result()
+
+                    # a pruned bound or a prediction still competes, but says too little of the
+                    # trial itself for the surrogate
+                    if final:
+                        self._observe(trial, energy)
+
+                    self.checkpoints.append({
+                        "kind": "trial",
+                        "generation": i,
+                        "target": target,
+                        "trial": trial,
+                        "energy": energy,
+                        "final": final
+                    })
+
+                    self._nfev += 1
+                    self._merge_trial(target, trial, energy, in_flight)
+
+                    if (completed := completed + 1) % self.num_population_members != 0:
+                        continue
+
+                    # a generation's worth of results has been merged
+                    self.checkpoint(i)
+
+                    self._publish_screening(i, proposed, proposed - screened_out)
+                    (proposed, screened_out) = (0, 0)
+
+                    if self.converged():
+                        converged = True
+                        continue
+
+                    self._log_generation(i)
+
+                    if i + 1 >= self.maxiter:
+                        gens_exhausted = True
+                        continue
+
+                    i += 1
+                    self.smilei_wrapper.generation = i
+                    self._dither()
+                    self._fit_surrogate()
+
+        # save any results merged after the last full generation
+        if completed % self.num_population_members != 0:
+            logger.info(f"Saving partial generation {i} with {completed % self.num_population_members} results")
+            self.checkpoint(i)
+
+        # a generation cut short resumes under its own number if optimise() is called again, but
+        # results merged after the last generation completed, while the rest drained, belong to it
+        if 0 < (merged := completed - (i - start_gen) * self.num_population_members) < self.num_population_members:
+            (self.smilei_wrapper.generation, self._completed) = (i - 1, merged)
         else:
-            logger.info(f"Optimisation converged after {i} generations!")
+            self._completed = 0
+
+        return i, gens_exhausted, sims_exhausted
+
+    def _observe(self, trial, energy):
+        """
+        Record a result for the surrogate to fit, unless it has no finite energy
+
+        The trial is copied, as a population member is overwritten in place when a trial beats it.
+        """
+        if np.isfinite(energy):
+            self._observations[0].append(np.copy(trial))
+            self._observations[1].append(energy)
+
+    def _fit_surrogate(self):
+        """
+        Refit the surrogate to every result so far, if screening is enabled and there are enough
+        """
+        if self.surrogate is None or len(self._observations[1]) <= self.parameter_count:
+            return
+
+        self.surrogate_model.fit(np.array(self._observations[0]), np.array(self._observations[1]))
+
+    def _screen(self, trials, targets):
+        """
+        Decide which trials are worth simulating
+
+        A trial is simulated if the surrogate gives it at least the configured probability of
+        beating its target, or if it is drawn for exploration. Every trial is simulated until the
+        surrogate has been fitted.
+
+        Arguments:
+        trials -- trial vectors, normalised to [0, 1], shape (M, N)
+        targets -- the energies of the population members they compete with, shape (M,)
+
+        Returns:
+        A boolean mask of the trials to simulate
+        """
+        if self.surrogate is None:
+            return np.ones(len(trials), dtype=bool)
+
+        (min_probability, explore) = self.surrogate
+
+        # always draw, so the RNG advances the same way whether or not the surrogate is fitted
+        exploring = self.random_number_generator.uniform(size=len(trials)) < explore
+
+        if not self.surrogate_model.fitted:
+            return np.ones(len(trials), dtype=bool)
+
+        return exploring | (self.surrogate_model.improvement_probability(trials, targets) >= min_probability)
+
+    def _publish_screening(self, generation, proposed, simulated):
+        if self.surrogate is None:
+            return
+
+        logger = logging.getLogger("supervisor")
+        logger.debug(f"Surrogate passed {simulated} of {proposed} trials in generation {generation}")
+
+        self.smilei_wrapper.metrics.publish(
+            "screening",
+            generation=generation,
+            proposed=proposed,
+            simulated=simulated,
+            observations=len(self._observations[1])
+        )
+
+    def _merge_trial(self, target, trial, energy, in_flight):
+        """
+        Merge a completed trial into the population, as SciPy's immediate updating does
+
+        If the trial becomes the best solution it is swapped into position 0, so the targets of
+        in-flight trials are swapped to match.
+        """
+        cv = np.atleast_2d([0.])
+
+        if not self._accept_trial(energy, True, cv, self.population_energies[target], self.feasible[target], self.constraint_violation[target]):
+            return
+
+        self.population[target] = trial
+        self.population_energies[target] = energy
+        self.feasible[target] = True
+        self.constraint_violation[target] = cv
+
+        if target != 0 and self._accept_trial(energy, True, cv, self.population_energies[0], self.feasible[0], self.constraint_violation[0]):
+            self.population_energies[[0, target]] = self.population_energies[[target, 0]]
+            self.population[[0, target], :] = self.population[[target, 0], :]
+            self.feasible[[0, target]] = self.feasible[[target, 0]]
+            self.constraint_violation[[0, target], :] = self.constraint_violation[[target, 0], :]
+
+            for (future, (t, in_flight_trial)) in in_flight.items():
+                if t == 0:
+                    in_flight[future] = (target, in_flight_trial)
+                elif t == target:
+                    in_flight[future] = (0, in_flight_trial)
+
+    def _dither(self):
+        """
+        Draw a new mutation constant, once per generation as in SciPy, if dithering is enabled
+        """
+        if self.dither is not None:
+            self.scale = self.random_number_generator.uniform(self.dither[0], self.dither[1])
+
+    def checkpoint(self, generation):
+        """
+        Append the population members changed since the last checkpoint to the checkpoint log,
+        along with everything else the next generation depends on
+        """
+        if self._checkpointed is None:
+            rows = np.arange(self.num_population_members)
+        else:
+            (population, energies) = self._checkpointed
+            rows = np.flatnonzero(np.any(self.population != population, axis=1) | (self.population_energies != energies))
 
+        self.checkpoints.append({
+            "kind": "generation",
+            "generation": generation,
+            "rows": rows,
+            "population": self.population[rows],
+            "population_energies": self.population_energies[rows],
+            "feasible": self.feasible[rows],
+            "constraint_violation": self.constraint_violation[rows],
+            "rng": self._rng_state(),
+            "nfev": self._nfev,
+            "scale": self.scale
+        })
+
+        self._checkpointed = (self.population.copy(), self.population_energies.copy())
+
+        self.history.append(generation, self._scale_parameters(self.population), self.population_energies)
+
+        finite = self.population_energies[np.isfinite(self.population_energies)]
+        self.smilei_wrapper.metrics.publish(
+            "generation",
+            generation=generation,
+            best=self.population_energies[0],
+            mean=np.mean(finite) if len(finite) else np.nan,
+            std=np.std(finite) if len(finite) else np.nan,
+            convergence=self.tol / (self.convergence + _MACHEPS),
+            nfev=self._nfev,
+            x=self._scale_parameters(self.population[0]).tolist()
+        )
+
+        self.smilei_wrapper.metrics.publish(
+            "timings",
+            generation=generation,
+            phases={
+                phase: {"count": count, "mean": total / count, "max": maximum, "total": total}
+                for (phase, (count, total, maximum)) in self.smilei_wrapper.timings.take_generation().items()
+            }
+        )
+
+    def restore(self, generation=None):
+        """
+        Replay the checkpoint log onto a solver loaded from solverinit.pickle
+
+        Asynchronous runs merge trials between generation checkpoints, so their trials are merged
+        again as they are replayed. Trials logged after the last generation checkpoint are merged
+        too, as they would have been had the run not been interrupted. Otherwise, those trials are
+        reused when the interrupted generation is resumed.
+
+        An asynchronous generation which had not completed, whether its last results were logged as
+        trials or saved as a partial generation, is resumed under its own number with those results.
+
+        Resuming at an earlier generation discards the later records from the log once the resumed
+        run appends its first checkpoint, as they no longer follow from the population.
+
+        Arguments:
+        generation -- the generation to restore, by default the last one checkpointed
+        """
+        logger = logging.getLogger("supervisor")
+
+        trials = []
+        results = Counter()  # the trials merged into each generation
+        end = 0
+
+        for (offset, record) in self.checkpoints.scan():
+            if record["kind"] == "trial":
+                trials.append(record)
+                continue
+
+            if generation is not None and record["generation"] > generation:
+                trials = []
+                break
+
+            self._replay_trials(trials)
+            results.update(record["generation"] for record in trials)
+            trials = []
+
+            rows = record["rows"]
+            self.population[rows] = record["population"]
+            self.population_energies[rows] = record["population_energies"]
+            self.feasible[rows] = record["feasible"]
+            self.constraint_violation[rows] = record["constraint_violation"]
+            self._set_rng_state(record["rng"])
+            self._nfev = record["nfev"]
+            self.scale = record["scale"]
+            self.smilei_wrapper.generation = record["generation"]
+            end = offset
+
+        if generation is not None:
+            if self.smilei_wrapper.generation != generation:
+                raise ValueError(f"Generation {generation} was not found in {self.checkpoints.path}")
+
+            self.checkpoints.truncate(end)
+
+        if trials and generation is None:
+            if self.asynchronous:
+                logger.info(f"Merging {len(trials)} trials completed after the last checkpoint")
+
+                # the generation these trials began was dithered after the last checkpoint
+                if trials[-1]["generation"] != self.smilei_wrapper.generation:
+                    self._dither()
+
+                self._replay_trials(trials)
+                results.update(record["generation"] for record in trials)
+                self.smilei_wrapper.generation = trials[-1]["generation"]
+            elif final := [record for record in trials if record.get("final", True)]:
+                # a pruned bound or a prediction is simulated again rather than reused
+                self.reuse_trials(
+                    trials[-1]["generation"],
+                    [record["trial"] for record in final],
+                    [record["energy"] for record in final]
+                )
+
+        self._completed = 0
+        if self.asynchronous and 0 < (completed := results[self.smilei_wrapper.generation]) < self.num_population_members:
+            logger.info(f"Resuming partial generation {self.smilei_wrapper.generation} with {completed} results")
+            self.smilei_wrapper.generation -= 1
+            self._completed = completed
+
+        self._checkpointed = (self.population.copy(), self.population_energies.copy())
+
+    def _replay_trials(self, trials):
+        """
+        Offer logged trials with final results to the surrogate, and merge every trial into the
+        population if they were merged as they completed
+        """
+        for record in trials:
+            if record.get("final", True):
+                self._observe(record["trial"], record["energy"])
+
+        if not self.asynchronous:
+            return
+
+        for record in trials:
+            self._nfev += 1
+            self._merge_trial(record["target"], record["trial"], record["energy"], {})
+
+    def _rng_state(self):
+        if isinstance(rng := self.random_number_generator, np.random.RandomState):
+            return rng.get_state(legacy=False)
+        else:
+            return rng.bit_generator.state
+
+    def _set_rng_state(self, state):
+        if isinstance(rng := self.random_number_generator, np.random.RandomState):
+            rng.set_state(state)
+        else:
+            rng.bit_generator.state = state
+
+    def _log_generation(self, generation):
+        logger = logging.getLogger("supervisor")
+
+        logger.info("=============================================")
+        logger.info(f"            Generation {generation} complete")
+        logger.info(pp_array(self.x))
+        logger.info(f"Energy is {-self.population_energies[0]:.3e}, convergence is: {self.tol / (self.convergence + _MACHEPS):.3e}")
+        logger.info("=============================================")
 
     def __getstate__(self):
         state = self.__dict__.copy()
@@ -137,6 +680,19 @@ class DESolver(DifferentialEvolutionSolver):
         return state
 
     def __setstate__(self, state):
+        state.setdefault('asynchronous', False)
+        state.setdefault('surrogate', None)
+        state.setdefault('surrogate_model', GaussianProcess())
+        state.setdefault('checkpoints', CheckpointLog(pathlib.Path("checkpoint.log")))
+        state.setdefault('history', HistoryIndex(pathlib.Path("history")))
+        state.setdefault('_checkpointed', None)
+        state.setdefault('_reusable', None)
+        state.setdefault('_sims_dispatched', 0)
+        state.setdefault('_completed', 0)
         self.__dict__.update(state)
+        if '_observations' not in state:
+            self._observations = ([], [])
+            for (member, energy) in zip(self.population, self.population_energies):
+                self._observe(member, energy)
         self._mapwrapper = MapWrapper(ThreadPoolExecutor(max_workers=self.threads).map)
         self.func = self.smilei_wrapper.run_sim
@@ -0,0 +1,73 @@
+import queue
+import threading
+
+from concurrent.futures import Future
+from mpi4py import MPI
+
+class CompletionDispatcher:
+    """
+    Waits on every outstanding MPI request from a single thread
+
+    Threads hand their requests to the dispatcher and block on the returned future, rather than
+    each polling its own request. The dispatcher tests all outstanding requests at once with
+    Testsome, backing off exponentially while nothing completes, so rank 0 stays close to idle
+    while simulations run. A blocking Waitany is avoided as most MPI implementations spin inside it
+    and it cannot be interrupted to pick up newly submitted requests.
+    """
+    def __init__(self, min_wait: float = 1e-3, max_wait: float = 0.25):
+        self.min_wait = min_wait
+        self.max_wait = max_wait
+        self.submitted = queue.SimpleQueue()
+        self.thread = threading.Thread(target=self._dispatch, name="completion-dispatcher", daemon=True)
+        self.thread.start()
+
+    def submit(self, req: MPI.Request) -> Future:
+        """
+        Start watching req, returning a future which is resolved once it completes
+        """
+        future = Future()
+        self.submitted.put((req, future))
+        return future
+
+    def wait(self, req: MPI.Request):
+        """
+        Block the calling thread until req completes
+        """
+        self.submit(req).result()
+
+    def _dispatch(self):
+        requests = []
+        futures = []
+        wait = self.min_wait
+
+        while True:
+            # with nothing outstanding, sleep until something is submitted
+            if not requests:
+                req, future = self.submitted.get()
+                requests.append(req)
+                futures.append(future)
+
+            while True:
+                try:
+                    req, future = self.submitted.get_nowait()
+                except queue.Empty:
+                    break
+                requests.append(req)
+                futures.append(future)
+
+            completed = MPI.Request.Testsome(requests)
+
+            if completed:
+                for i in sorted(completed, reverse=True):
+                    del requests[i]
+                    futures.pop(i).set_result(None)
+                wait = self.min_wait
+                continue
+
+            # nothing completed - back off, but wake early for new submissions
+            try:
+                req, future = self.submitted.get(timeout=wait)
+                requests.append(req)
+                futures.append(future)
+            except queue.Empty:
+                wait = min(2 * wait, self.max_wait)
@@ -1,38 +1,130 @@
-import happi
 import logging
 import numpy as np
 import pickle
 import time
 
+from functools import lru_cache
+from h5py import File  # read diagnostics directly - happi would re-execute the whole namelist
+from scipy.constants import c, e, m_e
+from typing import Optional, Tuple
+
+@lru_cache(maxsize=None)
+def axis_centres(axis: str) -> np.ndarray:
+    """
+    Compute the bin centres of a binning diagnostic axis, as happi does
+
+    Arguments:
+    axis -- an axis attribute written by Smilei, "type min max nbins logscale edge_inclusive [...]"
+    """
+    (_, axis_min, axis_max, bins, logscale, *_) = axis.split(" ")
+    (axis_min, axis_max, bins, logscale) = (float(axis_min), float(axis_max), int(bins), logscale == "1")
+    if logscale:
+        (axis_min, axis_max) = (np.log10(axis_min), np.log10(axis_max))
+    edges = np.linspace(axis_min, axis_max, bins + 1)
+    centres = (edges[:-1] + edges[1:]) / 2.
+    return 10.**centres if logscale else centres
+
+def latest_timestep(diag: File) -> str:
+    """
+    Find the name of the last timestep written to a diagnostic file
+    """
+    return max(name for name in diag if name.startswith("timestep"))
+
 def max_energy_negated(work_dir: str) -> float:
     """
     Find the highest energy bin and return its energy * -1
     """
     logger = logging.getLogger("supervisor")
-    sim_results = happi.Open(work_dir)
-    logger.debug(f"simulation results opened in {work_dir}")
-    final_energy_spectrum = sim_results.ParticleBinning(
-        0,
-        timesteps=sim_results.namelist.Main.number_of_timesteps
-    )
-    last_occupied_energy_bin = np.nonzero(final_energy_spectrum.getData()[0])[0][-1]
-    if last_occupied_energy_bin == len(final_energy_spectrum.getData()[0]) - 1:
+    with File(f"{work_dir}/ParticleBinning0.h5", "r") as diag:
+        logger.debug(f"simulation results opened in {work_dir}")
+        axis = diag.attrs["axis0"]
+        final_energy_spectrum = diag[latest_timestep(diag)][()]
+    centres = axis_centres(axis.decode() if isinstance(axis, bytes) else axis)
+    last_occupied_energy_bin = np.nonzero(final_energy_spectrum)[0][-1]
+    if last_occupied_energy_bin == len(final_energy_spectrum) - 1:
         logger.warning("Final energy bin not empty, data loss may have occurred")
-    return -final_energy_spectrum._centers[0][last_occupied_energy_bin]
+    return -centres[last_occupied_energy_bin]
 
 def screen_dep_energy_negated(work_dir: str) -> float:
     """
     Find the energy deposited on screen 0 and return * -1
     """
     logger = logging.getLogger("supervisor")
-    sim_results = happi.Open(work_dir)
-    logger.debug(f"simulation results opened in {work_dir}")
-    return -sim_results.Screen(0).getData()[-1]
+    with File(f"{work_dir}/Screen0.h5", "r") as diag:
+        logger.debug(f"simulation results opened in {work_dir}")
+        return -float(np.squeeze(diag[latest_timestep(diag)][()]))
+
+def screen_max_energy_negated(work_dir: str) -> float:
+    """
+    Find the top of the highest occupied energy bin on screen 0 and return its energy in eV * -1
+
+    Screen 0 is the coarse screen of the chirped _a_ml namelists, so on a running simulation this
+    bounds the highest energy, in eV, that their analysis() will report
+    """
+    with File(f"{work_dir}/Screen0.h5", "r") as diag:
+        axis = diag.attrs["axis0"]
+        spectrum = diag[latest_timestep(diag)][()]
+    (_, axis_min, axis_max, bins, *_) = (axis.decode() if isinstance(axis, bytes) else axis).split(" ")
+    if not (occupied := np.flatnonzero(spectrum)).size:
+        return -0.
+    top = float(axis_min) + (occupied[-1] + 1) * (float(axis_max) - float(axis_min)) / int(bins)
+    return -top * m_e * c**2 / e
+
+# the diagnostic read by each goal function which can be evaluated while a simulation is running
+INTERIM_DIAGNOSTICS = {
+    "max_energy_negated": "ParticleBinning0.h5",
+    "screen_dep_energy_negated": "Screen0.h5",
+    "screen_max_energy_negated": "Screen0.h5"
+}
+
+# written by namelists which support pruning, holding the number of timesteps in the run
+TIMESTEPS_FILE = "number_of_timesteps.npy"
 
-def load_result_from_file(work_dir: str) -> float:
+def interim_goal(goal: str, work_dir: str, min_dumps: int) -> Optional[Tuple[float, float]]:
+    """
+    Evaluate a goal function on the latest output of a simulation which is still running
+
+    Returns:
+    The goal function's current value and the fraction of the run completed at the dump it was
+    read from, NaN if the namelist did not write TIMESTEPS_FILE. None if the diagnostic holds fewer
+    than min_dumps timesteps, could not be read while Smilei was writing to it, or holds nothing
+    yet - a goal which builds up over the run is zero until then, which bounds nothing
+    """
+    try:
+        with File(f"{work_dir}/{INTERIM_DIAGNOSTICS[goal]}", "r") as diag:
+            if sum(1 for name in diag if name.startswith("timestep")) < min_dumps:
+                return None
+            timestep = int(latest_timestep(diag)[len("timestep"):])
+        value = globals()[goal](work_dir)
+    except (OSError, KeyError, ValueError, IndexError):
+        return None
+
+    if value == 0. or not np.isfinite(value):
+        return None
+
+    try:
+        fraction = timestep / int(np.load(f"{work_dir}/{TIMESTEPS_FILE}"))
+    except (OSError, ValueError):
+        fraction = np.nan
+
+    return value, fraction
+
+def load_result_from_file(work_dir: str, timeout: float = 60.) -> float:
     """
     Load a pickled result from the work dir - useful if analysis done by smilei
+
+    Namelists write the result under a temporary name and rename it into place, so the file is
+    complete as soon as it exists. It normally exists by the time Smilei signals exit, but the
+    rename may take a moment to become visible on a network filesystem, so retry with backoff.
     """
-    time.sleep(1)  # This wait is necessary to give Smilei time to shutdown
-    with open(f"{work_dir}/result", "rb") as result_file:
-        return pickle.load(result_file)
+    wait = 0.001
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            with open(f"{work_dir}/result", "rb") as result_file:
+                return pickle.load(result_file)
+        except FileNotFoundError:
+            if time.monotonic() > deadline:
+                raise
+            time.sleep(wait)
+            wait = min(2 * wait, 1.)
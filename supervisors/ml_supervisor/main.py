@@ -1,4 +1,5 @@
 import argparse
+import os
 import pathlib
 import threading
 import sys
@@ -7,8 +8,9 @@ from mpi4py import MPI
 
 import utils
 
+from cache import ResultCache
 from desolver import DESolver
-from goal_functions import max_energy_negated, screen_dep_energy_negated, load_result_from_file
+from goal_functions import INTERIM_DIAGNOSTICS, max_energy_negated, screen_dep_energy_negated, screen_max_energy_negated, load_result_from_file
 from smilei_wrapper import SmileiWrapper
 
 # setup logging - split logs into two files
@@ -116,13 +118,110 @@ parser.add_argument(
     "--athreads",
     default=4,
     type=int,
-    help="The number of threads that can perform analysis at a time"
+    help="The number of threads that can perform analysis at a time. The built in goal functions only read the final timestep of a single diagnostic, so this rarely needs to be low"
 )
 parser.add_argument(
     "--maxsims",
     type=int,
     help="The maximum number of simulations to run before terminating. The optimisation is resumable if this limit is exhausted; a further `maxsims` simulations will be run"
 )
+parser.add_argument(
+    "--pool",
+    action="store_true",
+    help="Spawn usize - 1 long-lived workers once and reuse them for every simulation, rather than spawning smilei_sub per simulation. This removes the limit on the number of simulations per job"
+)
+parser.add_argument(
+    "--batch",
+    default="1",
+    type=str,
+    help="The number of simulations each pool worker runs at once, sharing its OpenMP threads evenly. Small simulations use a worker's threads better several at a time, as Smilei's start-up is single-threaded. 'auto' chooses the number from the overhead measured on the first simulations, up to OMP_NUM_THREADS; set it explicitly if memory is short. Requires --pool"
+)
+parser.add_argument(
+    "--spawnconcurrency",
+    type=int,
+    help="The number of simulations that may be spawned at once, by default no limit so a generation's simulations all start together. Set to 1 to spawn one at a time, if the MPI implementation cannot spawn from several threads at once"
+)
+parser.add_argument(
+    "--async",
+    action="store_true",
+    dest="asynchronous",
+    help="Submit a new trial as soon as any worker frees up and merge each result into the population as it arrives, rather than waiting for every trial in a generation to finish"
+)
+parser.add_argument(
+    "--cache",
+    type=pathlib.Path,
+    help="A directory in which to cache results. Trials whose parameters match a cached result are not simulated. The cache survives restarts and can be shared by jobs using the same namelist and goal function"
+)
+parser.add_argument(
+    "--cachedigits",
+    default=6,
+    type=int,
+    help="The number of significant figures to which parameters must match to share a cached result"
+)
+parser.add_argument(
+    "--prune",
+    action="append",
+    type=float,
+    metavar="FACTOR",
+    help="Stop a simulation early once FACTOR times the goal function's value on its latest diagnostic dump cannot beat the population member its trial competes with. FACTOR bounds how much the goal value can still improve by the end of a run, so must be at least 1 and should be calibrated for the namelist. May be given several times, each factor applying in turn over an equal fraction of the run, which the namelist gives in number_of_timesteps.npy; without it the first factor is always used. A dump holding nothing yet is never pruned on. Requires --pool and --maxenergy, --depenergy or --prunegoal"
+)
+parser.add_argument(
+    "--prunegoal",
+    choices=("maxenergy", "depenergy", "screenenergy"),
+    help="The goal function evaluated on a running simulation's diagnostics when pruning, by default the goal function itself. Needed when analysis is performed by Smilei: screenenergy bounds the result of the chirped _a_ml namelists and depenergy matches density_a_ml.py"
+)
+parser.add_argument(
+    "--prunedumps",
+    default=2,
+    type=int,
+    help="The number of diagnostic dumps a simulation must have written before it can be pruned"
+)
+parser.add_argument(
+    "--pruneinterval",
+    default=30.,
+    type=float,
+    help="The number of seconds between checks of a running simulation's diagnostics when pruning"
+)
+parser.add_argument(
+    "--scratch",
+    type=str,
+    help="A root directory on node-local storage, such as /dev/shm or $TMPDIR, under which each worker creates its simulations' work directories instead of the shared job directory. Environment variables are expanded on each worker's node, so quote them. Requires --pool"
+)
+parser.add_argument(
+    "--artifact",
+    action="append",
+    default=[],
+    type=str,
+    dest="artifacts",
+    help="A glob matching files to copy back from each scratch work directory to artifacts/ in the job directory once the simulation has been post-processed. May be given several times. Everything else is deleted with the work directory"
+)
+parser.add_argument(
+    "--fidelity",
+    action="append",
+    default=[],
+    type=float,
+    dest="fidelities",
+    help="A fidelity between 0 and 1 at which to screen trials before running them at full fidelity. May be given several times to build a ladder, which is climbed from the lowest fidelity. The namelist finds the fidelity in fidelity.npy next to par_vec.npy, and should scale its resolution to match"
+)
+parser.add_argument(
+    "--promote",
+    default=1.,
+    type=float,
+    metavar="FACTOR",
+    help="Promote a trial to the next fidelity only while FACTOR times its goal value at the current fidelity beats the population member it competes with. FACTOR bounds how much better a trial can do at full fidelity, so must be at least 1 and should be calibrated for the namelist"
+)
+parser.add_argument(
+    "--surrogate",
+    type=float,
+    metavar="PROBABILITY",
+    help="Fit a Gaussian process to every result so far, and only simulate trials it gives at least this probability of beating the population member they compete with, plus an exploration quota. Screened out trials are rejected without being simulated"
+)
+parser.add_argument(
+    "--explore",
+    default=0.1,
+    type=float,
+    help="The fraction of trials simulated regardless of the surrogate, so regions it wrongly believes to be poor are still explored. Must be above 0 with --async"
+)
 parser.add_argument(
     "namelist",
     type=pathlib.Path,
@@ -156,6 +255,60 @@ if (goal_func := args.goal_func) is None:
     logger.warning("No goal function was set, assuming analysis will be performed by Smilei")
     goal_func = load_result_from_file
 
+# check work directories can be staged
+if args.scratch is not None and not args.pool:
+    logger.error("Node-local scratch requires a worker pool, pass --pool")
+    sys.exit(1)
+
+# parse batch size
+if args.batch == "auto":
+    batch = None
+elif args.batch.isdigit() and int(args.batch) >= 1:
+    batch = int(args.batch)
+else:
+    logger.error("The batch size must be a positive integer or 'auto'")
+    sys.exit(1)
+
+if batch != 1 and not args.pool:
+    logger.error("Batching simulations requires a worker pool, pass --pool")
+    sys.exit(1)
+
+# check pruning can be performed
+if args.prune is not None:
+    if not args.pool:
+        logger.error("Pruning requires a worker pool, pass --pool")
+        sys.exit(1)
+    interim_func = {
+        None: goal_func,
+        "maxenergy": max_energy_negated,
+        "depenergy": screen_dep_energy_negated,
+        "screenenergy": screen_max_energy_negated
+    }[args.prunegoal]
+    if interim_func.__name__ not in INTERIM_DIAGNOSTICS:
+        logger.error(f"Pruning is not supported with goal function {interim_func.__name__}, pass --prunegoal")
+        sys.exit(1)
+    if min(args.prune) < 1.:
+        logger.error("The pruning factors must be at least 1")
+        sys.exit(1)
+
+# check the fidelity ladder
+if args.fidelities:
+    if not all(0. < level < 1. for level in args.fidelities):
+        logger.error("Fidelities must be between 0 and 1, full fidelity is always run last")
+        sys.exit(1)
+    if args.promote < 1.:
+        logger.error("The promotion factor must be at least 1")
+        sys.exit(1)
+
+# check surrogate screening
+if args.surrogate is not None:
+    if not 0. < args.surrogate < 1.:
+        logger.error("The surrogate's probability threshold must be between 0 and 1")
+        sys.exit(1)
+    if not 0. <= args.explore <= 1. or (args.asynchronous and args.explore == 0.):
+        logger.error("The exploration fraction must be between 0 and 1, and above 0 with --async")
+        sys.exit(1)
+
 # MPI Setup
 comm = MPI.COMM_WORLD
 rank = comm.Get_rank()
@@ -173,22 +326,52 @@ else:
 comm.Set_errhandler(MPI.ERRORS_ARE_FATAL)
 MPI.COMM_SELF.Set_errhandler(MPI.ERRORS_ARE_FATAL)
 
+# spawning from several threads at once needs full thread support
+if (spawn_concurrency := args.spawnconcurrency) != 1 and MPI.Query_thread() != MPI.THREAD_MULTIPLE:
+    logger.warning("MPI does not support MPI_THREAD_MULTIPLE, simulations will be spawned one at a time")
+    spawn_concurrency = 1
+
+# construct result cache
+cache = None if args.cache is None else ResultCache(args.cache, args.namelist, goal_func.__name__, args.cachedigits)
+
 # construct SmileiWrapper
-smilei_wrapper = SmileiWrapper(args.namelist, goal_func, args.athreads)
+prune = None if args.prune is None else (interim_func.__name__, tuple(args.prune), args.prunedumps, args.pruneinterval)
+fidelity = None if not args.fidelities else (tuple(sorted(set(args.fidelities))), args.promote)
+smilei_wrapper = SmileiWrapper(
+    args.namelist,
+    goal_func,
+    args.athreads,
+    pool_size=usize - 1 if args.pool else None,
+    cache=cache,
+    prune=prune,
+    spawn_concurrency=spawn_concurrency,
+    scratch=args.scratch,
+    artifacts=tuple(args.artifacts),
+    fidelity=fidelity,
+    batch=batch
+)
 
-# construct Solver
+# construct Solver - with enough threads to fill every slot of the pool, however many it may have
+slots_per_worker = int(os.environ.get("OMP_NUM_THREADS", 1)) if batch is None else batch
 solver = DESolver(
     smilei_wrapper,
     bounds,
-    threads=usize - 1,
+    threads=(usize - 1) * slots_per_worker,
     maxiter=args.maxiter,
     popsize=args.popsize,
     strategy=strategy,
     mutation=mutation,
     recombination=args.crossover,
-    max_sims=args.maxsims
+    max_sims=args.maxsims,
+    asynchronous=args.asynchronous,
+    surrogate=None if args.surrogate is None else (args.surrogate, args.explore)
 )
 
-solver.prepare()
+smilei_wrapper.start_pool()
+
+try:
+    solver.prepare()
 
-solver.optimise()
+    solver.optimise()
+finally:
+    smilei_wrapper.close()
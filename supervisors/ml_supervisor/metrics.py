@@ -0,0 +1,109 @@
+import contextlib
+import json
+import math
+import pathlib
+import threading
+import time
+
+class MetricsPublisher:
+    """
+    An append-only stream of progress metrics, one JSON object per line
+
+    Every trial and every generation publishes a line as it happens, so a running optimisation can
+    be watched with watch_metrics.py, or anything else able to follow a file, without reading the
+    checkpoints. Each line holds the kind of event, the wall-clock time and the event's fields.
+    """
+    def __init__(self, path: pathlib.Path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.metrics_file = None
+
+    def publish(self, kind: str, **fields):
+        """
+        Append an event of the given kind, flushing it so followers see it immediately
+        """
+        line = json.dumps({"kind": kind, "time": time.time(), **fields})
+
+        with self.lock:
+            if self.metrics_file is None:
+                self.metrics_file = open(self.path, "a")
+
+            print(line, file=self.metrics_file, flush=True)
+
+    def close(self):
+        with self.lock:
+            if self.metrics_file is not None:
+                self.metrics_file.close()
+                self.metrics_file = None
+
+    def __getstate__(self):
+        return {"path": self.path}
+
+    def __setstate__(self, state):
+        self.__init__(state["path"])
+
+
+@contextlib.contextmanager
+def timed(timings: dict, phase: str):
+    """
+    Add the wall time spent in the body of the with statement to timings[phase]
+    """
+    start = time.perf_counter()
+
+    try:
+        yield
+    finally:
+        timings[phase] = timings.get(phase, 0.) + time.perf_counter() - start
+
+
+class PhaseTimings:
+    """
+    Aggregates the per-phase timings and resource usage of every simulation, both since the last
+    generation and since the supervisor started
+
+    Each aggregate maps a phase to its count, total and maximum. Phases which are unknown for a
+    simulation, given as NaN, are left out of its count.
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.generation = {}
+        self.run = {}
+
+    def add(self, timings: dict):
+        with self.lock:
+            for aggregate in (self.generation, self.run):
+                for (phase, value) in timings.items():
+                    if math.isnan(value):
+                        continue
+
+                    (count, total, maximum) = aggregate.get(phase, (0, 0., value))
+                    aggregate[phase] = (count + 1, total + value, max(maximum, value))
+
+    def take_generation(self) -> dict:
+        """
+        Return the aggregate since the last call, and start a new one
+        """
+        with self.lock:
+            (aggregate, self.generation) = (self.generation, {})
+
+        return aggregate
+
+    def report(self) -> list:
+        """
+        Lines summarising every simulation since the supervisor started, phase by phase
+        """
+        with self.lock:
+            run = dict(self.run)
+
+        lines = [f"{'phase':<20}{'count':>8}{'mean':>12}{'max':>12}{'total':>12}"]
+
+        for (phase, (count, total, maximum)) in run.items():
+            lines.append(f"{phase:<20}{count:>8d}{total / count:>12.4g}{maximum:>12.4g}{total:>12.4g}")
+
+        return lines
+
+    def __getstate__(self):
+        return {}
+
+    def __setstate__(self, state):
+        self.__init__()
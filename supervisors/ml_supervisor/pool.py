@@ -0,0 +1,184 @@
+import logging
+import numpy as np
+import os
+import pathlib
+import queue
+import sys
+import threading
+
+from mpi4py import MPI
+
+from dispatcher import CompletionDispatcher
+from metrics import timed
+from protocol import REPLY_LOOP, REPLY_PRUNED, REPLY_SIZE, REPLY_STATUS, REPLY_WALL, TAG_COMMAND, TAG_REPLY
+
+# when choosing the batch size, the largest fraction of a worker's thread time which may be left
+# idle by the single-threaded part of Smilei's start-up
+MAX_IDLE_FRACTION = 0.1
+
+def choose_batch(init: float, loop: float, threads: int) -> int:
+    """
+    The smallest number of simulations per worker which keeps the threads left idle during Smilei's
+    single-threaded start-up within MAX_IDLE_FRACTION of the worker's thread time
+
+    Each of batch simulations gets threads // batch threads. While one initialises, all but one of
+    its threads are idle, whereas the PIC loop is assumed to scale with its threads.
+
+    Arguments:
+    init -- the wall time of a simulation outside the PIC loop, in seconds
+    loop -- the wall time of the PIC loop with all of a worker's threads, in seconds
+    threads -- the OpenMP threads available to each worker
+
+    Returns:
+    The batch size, at most threads
+    """
+    work = loop * threads
+
+    for batch in range(1, threads + 1):
+        share = threads // batch
+
+        # a larger batch gets the same share, leaving fewer threads unused
+        if threads // share != batch:
+            continue
+
+        if (share - 1) * init <= MAX_IDLE_FRACTION * (share * init + work):
+            return batch
+
+    return threads
+
+class WorkerPool:
+    """
+    A fixed set of long-lived workers, each able to run a batch of Smilei simulations at a time
+
+    The workers are spawned once with a single MPI_Comm_spawn, which avoids paying process startup
+    on every simulation and keeps the job clear of the MPI runtime's limit on spawned processes.
+
+    Each worker has batch slots. Simulations sharing a worker run concurrently with an even share
+    of its OpenMP threads, so one simulation's single-threaded start-up overlaps with the others'
+    PIC loops rather than leaving threads idle.
+    """
+    def __init__(self, namelist: pathlib.Path, size: int, dispatcher: CompletionDispatcher, batch: int = 1):
+        """
+        Arguments:
+        namelist -- path to the namelist
+        size -- the number of workers to spawn
+        dispatcher -- wakes the threads waiting on replies
+        batch -- the number of simulations each worker runs at once, or None to start with one and
+            choose the batch size from the overhead measured on the first simulation per worker
+        """
+        logger = logging.getLogger("supervisor")
+
+        self.size = size
+        self.dispatcher = dispatcher
+        self.idle = queue.Queue()
+        # every worker has the same OpenMP threads as the supervisor, set by the job
+        self.threads = int(os.environ.get("OMP_NUM_THREADS", 1))
+        self.batch = 1 if batch is None else batch
+        self.overheads = None if batch is not None else []  # (init, loop) of the first simulations
+        self.batch_lock = threading.Lock()
+
+        logger.info(f"Spawning a pool of {size} workers")
+
+        self.inter = MPI.COMM_SELF.Spawn(
+            command=sys.executable,
+            args=[
+                str(pathlib.Path(__file__).with_name("worker.py")),
+                str(namelist.resolve())
+            ],
+            maxprocs=size
+        )
+
+        self._add_slots(0, self.batch)
+
+        logger.info(f"Worker pool ready, running {self.batch} simulations per worker")
+
+    @property
+    def slots(self) -> int:
+        return self.size * self.batch
+
+    def _add_slots(self, first: int, last: int):
+        # slot by slot, so simulations spread over the workers before any are shared
+        for slot in range(first, last):
+            for rank in range(self.size):
+                self.idle.put((rank, slot))
+
+    def _measure(self, reply: np.ndarray):
+        """
+        Record a simulation's overhead, and choose the batch size once every worker has reported one
+        """
+        logger = logging.getLogger("supervisor")
+
+        if np.isnan(reply[REPLY_LOOP]):
+            return
+
+        with self.batch_lock:
+            if self.overheads is None:
+                return
+
+            self.overheads.append((reply[REPLY_WALL] - reply[REPLY_LOOP], reply[REPLY_LOOP]))
+
+            if len(self.overheads) < self.size:
+                return
+
+            (init, loop) = np.median(self.overheads, axis=0)
+            (batch, self.overheads) = (choose_batch(init, loop, self.threads), None)
+
+            logger.info(f"Simulations spend {init:.1f} s outside and {loop:.1f} s in the PIC loop, running {batch} per worker with {self.threads // batch} threads each")
+
+            self._add_slots(self.batch, batch)
+            self.batch = batch
+
+    def run(self, work_dir: str, goal: str, prune: tuple = None, timings: dict = None, staging: tuple = None) -> np.ndarray:
+        """
+        Run a simulation in work_dir on the next idle worker, blocking until it completes
+
+        Arguments:
+        work_dir -- the simulation's work directory, containing par_vec.npy, or None if staging
+        goal -- the name of a function in goal_functions, which the worker applies to work_dir
+        prune -- optional pruning settings, see worker.wait_or_prune
+        timings -- if given, the time spent waiting for an idle worker is added to its "wait" phase
+        staging -- optional (scratch root, par_vec, fidelity, artifact directory, artifact
+            patterns), to have the worker create the work directory on its own node, see
+            worker.stage_in
+
+        Returns:
+        The worker's reply, indexed by the REPLY_* constants in protocol
+        """
+        logger = logging.getLogger("supervisor")
+
+        with timed({} if timings is None else timings, "wait"):
+            (rank, slot) = self.idle.get()
+
+        # a lone simulation keeps the threads set by the job
+        threads = None if self.batch == 1 else max(1, self.threads // self.batch)
+
+        try:
+            logger.debug(f"Dispatching simulation to worker {rank}, slot {slot}")
+            self.inter.send(("run", (work_dir, goal, prune, staging, slot, threads)), dest=rank, tag=TAG_COMMAND)
+
+            reply = np.empty(REPLY_SIZE, dtype=np.float64)
+            self.dispatcher.wait(
+                self.inter.Irecv([reply, MPI.DOUBLE], source=rank, tag=TAG_REPLY + slot)
+            )
+        finally:
+            self.idle.put((rank, slot))
+
+        if reply[REPLY_STATUS] != 0 and not reply[REPLY_PRUNED]:
+            logger.warning(f"Worker {rank} reported smilei_sub exit status {int(reply[REPLY_STATUS])}")
+        elif self.overheads is not None and not reply[REPLY_PRUNED]:
+            self._measure(reply)
+
+        return reply
+
+    def close(self):
+        """
+        Stop every worker and disconnect from them
+        """
+        logger = logging.getLogger("supervisor")
+
+        for rank in range(self.size):
+            self.inter.send(("stop", None), dest=rank, tag=TAG_COMMAND)
+
+        self.inter.Disconnect()
+
+        logger.info("Worker pool stopped")
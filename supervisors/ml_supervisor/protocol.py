@@ -0,0 +1,58 @@
+"""
+What the supervisor and its pool workers share: the messages they exchange, and the files a
+simulation's work directory is given
+
+This module has no side effects on import, so the supervisor can use it without picking up any of
+the worker's set up.
+"""
+import numpy as np
+import os
+
+TAG_COMMAND = 1
+# replies are tagged TAG_REPLY + slot, so a worker running several simulations at once can reply to
+# each in any order
+TAG_REPLY = 2
+
+# reply layout - a single float64 message per simulation. The result is NaN if post-processing
+# failed. If the simulation was pruned, the result is the bound on its final value
+REPLY_STATUS = 0
+REPLY_RESULT = 1
+REPLY_PRUNED = 2
+REPLY_RANK = 3
+# timings of the simulation in seconds, NaN if unknown - smilei_sub's wall time, the part of it
+# spent in the PIC loop, and the worker's post-processing
+REPLY_WALL = 4
+REPLY_LOOP = 5
+REPLY_POST = 6
+# smilei_sub's peak resident set size in bytes
+REPLY_RSS = 7
+# the total size of the files in the work directory once the simulation is done, in bytes
+REPLY_OUTPUT = 8
+REPLY_SIZE = 9
+
+# a simulation run below full fidelity finds its fidelity, between 0 and 1, in this file next to
+# par_vec.npy. Namelists which support a fidelity ladder scale their resolution to match
+FIDELITY_FILE = "fidelity.npy"
+
+
+def output_size(work_dir: str) -> int:
+    """
+    The total size of every file in the work directory, in bytes
+    """
+    return sum(
+        os.path.getsize(os.path.join(directory, name))
+        for (directory, _, names) in os.walk(work_dir) for name in names
+    )
+
+
+def write_inputs(work_dir: str, par_vec: np.ndarray, fidelity: float = 1.):
+    """
+    Write the parameter file into a work directory, along with the fidelity file if the
+    simulation is to run below full fidelity
+    """
+    with open(f"{work_dir}/par_vec.npy", "wb") as par_vec_file:
+        np.save(par_vec_file, par_vec, allow_pickle=False)
+
+    if fidelity < 1.:
+        with open(f"{work_dir}/{FIDELITY_FILE}", "wb") as fidelity_file:
+            np.save(fidelity_file, np.float64(fidelity), allow_pickle=False)
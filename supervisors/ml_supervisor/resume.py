@@ -1,5 +1,5 @@
 import argparse
-import os
+import numpy as np
 import pathlib
 import pickle
 import sys
@@ -17,7 +17,12 @@ parser = argparse.ArgumentParser(description="Optimise the parameters of a PIC s
 parser.add_argument(
     "--solver",
     type=pathlib.Path,
-    help="Path to the pickled solver to resume from"
+    help="Path to a pickled solver to resume from, as checkpointed by earlier versions. By default the solver is rebuilt from solverinit.pickle and checkpoint.log"
+)
+parser.add_argument(
+    "--generation",
+    type=int,
+    help="The generation to rebuild the solver at, by default the last one in checkpoint.log"
 )
 
 args = parser.parse_args()
@@ -38,25 +43,27 @@ else:
 comm.Set_errhandler(MPI.ERRORS_ARE_FATAL)
 MPI.COMM_SELF.Set_errhandler(MPI.ERRORS_ARE_FATAL)
 
-if (solver_file := args.solver) is None:
-    solver_file = sorted(
-        map(
-            lambda f: f.name,
-            filter(
-                lambda f: f.is_file() and "solver" in f.name and "init" not in f.name,
-                os.scandir()
-            )
-        ),
-        reverse=True
-    )[0]
+if args.solver is None:
+    with open("solverinit.pickle", 'rb') as pickle_file:
+        solver = pickle.load(pickle_file)
+
+    solver.restore(args.generation)
+else:
+    with open(args.solver, 'rb') as pickle_file:
+        solver = pickle.load(pickle_file)
 
-    start_gen = int(solver_file[6:9]) + 1
+# a pickled solver has no log of the trials completed in the interrupted generation, so reuse
+# those in its generation file instead
+if args.solver is not None and not solver.asynchronous:
+    start_gen = 0 if (gen := solver.smilei_wrapper.generation) is None else gen + 1
 
-    if f"gen{start_gen:0>3d}.csv" in os.listdir():
-        logger.error("Expected to resume at start of generation")
-        sys.exit(1)
+    if (gen_file := pathlib.Path(f"gen{start_gen:0>3d}.csv")).is_file():
+        results = np.loadtxt(gen_file, delimiter=",", ndmin=2)
+        solver.reuse_trials(start_gen, solver._unscale_parameters(results[:, :-1]), -results[:, -1])
 
-with open(solver_file, 'rb') as pickle_file:
-    solver = pickle.load(pickle_file)
+solver.smilei_wrapper.start_pool()
 
-solver.optimise()
+try:
+    solver.optimise()
+finally:
+    solver.smilei_wrapper.close()
@@ -2,40 +2,87 @@ import logging
 import numpy as np
 import os
 import pathlib
-import shutil
 import tempfile
 import threading
 import time
+import uuid
 
 from collections.abc import Callable
+from typing import Optional, Tuple
 from mpi4py import MPI
 
+from cache import ResultCache
+from cleanup import Cleaner
+from dispatcher import CompletionDispatcher
+from metrics import MetricsPublisher, PhaseTimings, timed
+from pool import WorkerPool
+from trial_store import TrialStore
 from utils import pp_array
+from protocol import REPLY_LOOP, REPLY_OUTPUT, REPLY_POST, REPLY_PRUNED, REPLY_RANK, REPLY_RESULT, REPLY_RSS, REPLY_WALL, output_size, write_inputs
 
 class SmileiWrapper:
     def __init__(
         self,
         namelist: pathlib.Path,
         post_process: Callable[[str], float],
-        analysis_concurrency: int
+        analysis_concurrency: int,
+        pool_size: int = None,
+        cache: ResultCache = None,
+        prune: Tuple[str, Tuple[float, ...], int, float] = None,
+        spawn_concurrency: int = None,
+        scratch: str = None,
+        artifacts: Tuple[str, ...] = (),
+        fidelity: Tuple[Tuple[float, ...], float] = None,
+        batch: int = 1
     ):
         self.namelist = namelist
         self.post_process = post_process
         self.generation = None
         self.analysis_concurrency = analysis_concurrency
-        self.mpi_spawn_lock = threading.Lock()
+        self.pool_size = pool_size
+        self.pool = None
+        self.cache = cache
+        self.prune = prune
+        self.spawn_concurrency = spawn_concurrency
+        self.scratch = scratch
+        self.artifacts = artifacts
+        self.fidelity = fidelity
+        self.batch = batch
+        self.cleaner = Cleaner()
+        self.trials = TrialStore(pathlib.Path("trials"))
+        self.screening_trials = self._screening_trials()
+        self.metrics = MetricsPublisher(pathlib.Path("metrics.jsonl"))
+        self.timings = PhaseTimings()
+        self.in_flight = 0
+        self.in_flight_lock = threading.Lock()
+        self.spawn_semaphore = threading.Semaphore(spawn_concurrency or 2**31 - 1)
+        self.spawn_comms = threading.local()
+        self.spawn_comms_lock = threading.Lock()
         self.analysis_semaphore = threading.Semaphore(analysis_concurrency)
+        self.dispatcher = CompletionDispatcher()
 
-    def run_sim(self, par_vec: np.ndarray) -> float:
+    def run_sim(self, par_vec: np.ndarray, target: float = np.inf) -> float:
         """
         Run a single Smilei simulation in another MPI process
 
         Note the simulation is run in a temporary directory. Any results needed should be either be 
         processed or copied in the post_process function
 
+        If a result cache is configured and already holds a result for par_vec, that result is
+        returned without running a simulation
+
+        If pruning is configured, the simulation may be stopped early once it cannot beat target.
+        The bound on its final value is returned instead, which is worse than target
+
+        If a fidelity ladder is configured, the trial is first simulated at each of its fidelities
+        in turn, and only promoted to the next while it is predicted to beat target. A trial which
+        is not promoted never runs at full fidelity, and its prediction is returned instead, which
+        is worse than target
+
         Arguments:
         par_vec -- a parameter vector to pass to Smilei 
             - will be stored as the variable x and can be accessed in the namelist
+        target -- the energy of the population member this trial competes with
         namelist -- path to the namelist
         post_process -- a function to use to process the results, taking the work directory as an
             argument
@@ -43,75 +90,317 @@ class SmileiWrapper:
         Returns:
         The result of post_process
         """
+        return self.run_trial(par_vec, target)[0]
+
+    def run_trial(self, par_vec: np.ndarray, target: float = np.inf) -> Tuple[float, bool]:
+        """
+        Run a single Smilei simulation as run_sim does, also reporting whether its result is final
+
+        A result is final if the simulation ran in full at full fidelity and gave a finite goal
+        value. A pruned bound, a prediction from a lower fidelity or a failed simulation is not,
+        so is no measure of the trial itself.
+
+        Returns:
+        The result of post_process, and whether it is final
+        """
+        with self.in_flight_lock:
+            self.in_flight += 1
+
+        try:
+            return self._run_ladder(par_vec, target)
+        finally:
+            with self.in_flight_lock:
+                self.in_flight -= 1
+
+    def _run_ladder(self, par_vec: np.ndarray, target: float) -> Tuple[float, bool]:
+        """
+        Climb the fidelity ladder, if configured, then run the simulation at full fidelity
+        """
         logger = logging.getLogger("supervisor")
 
-        # create temporary work directory - have to do it this way as directory can fail to delete on HPC...
-        work_dir = tempfile.mkdtemp(dir=os.getcwd())
+        # a trial with nothing to beat, or with a cached result, goes straight to full fidelity
+        if self.fidelity is not None and not np.isinf(target) and (self.cache is None or self.cache.get(par_vec) is None):
+            (levels, factor) = self.fidelity
+
+            for level in levels:
+                (result, _) = self._run_sim(par_vec, target, level)
+
+                # goal values are negated, so lower is better
+                if (prediction := factor * result) > target:
+                    logger.debug(f"Not promoted from fidelity {level:g}, prediction {-prediction:.3e} cannot beat {-target:.3e}")
+                    return (prediction, False)
+
+        return self._run_sim(par_vec, target)
+
+    def _run_sim(self, par_vec: np.ndarray, target: float, fidelity: float = 1.) -> Tuple[float, bool]:
+        logger = logging.getLogger("supervisor")
+
+        start = time.perf_counter()
+
+        # wall time of each phase in seconds, along with the child's peak RSS and output size
+        timings = {}
+
+        # results below full fidelity are not comparable with full results, so are never cached
+        with timed(timings, "cache"):
+            cached = None if self.cache is None or fidelity < 1. else self.cache.get(par_vec)
+
+        if cached is not None:
+            logger.debug(f"Found cached result: {-cached:.3e}, parameters: {pp_array(par_vec)}")
+            self.write_result(par_vec, cached, time.perf_counter() - start, timings=timings, cached=True)
+            return (cached, True)
+
+        if self.scratch is None:
+            with timed(timings, "setup"):
+                # create temporary work directory - have to do it this way as directory can fail to delete on HPC...
+                work_dir = tempfile.mkdtemp(dir=os.getcwd())
+
+                # Create parameter file, and fidelity file if needed
+                write_inputs(work_dir, par_vec, fidelity)
+
+            staging = None
+        else:
+            # the worker creates the work directory on its own node, and copies back the artifacts
+            work_dir = None
+            artifact_dir = os.path.join(os.getcwd(), "artifacts", uuid.uuid4().hex[:16])
+            staging = (self.scratch, par_vec, fidelity, artifact_dir, self.artifacts)
+
+            if self.artifacts:
+                logger.debug(f"Artifacts will be copied to {artifact_dir}")
+
+        if self.pool is not None:
+            # hand the simulation to a long-lived worker, which also post-processes the results
+            logger.debug(f"Starting Smilei simulation at fidelity {fidelity:g} with parameters: {pp_array(par_vec)}")
+            # the pruning factor is calibrated on full simulations
+            prune = None if self.prune is None or np.isinf(target) or fidelity < 1. else (target, *self.prune)
+
+            with timed(timings, "dispatch"):
+                reply = self.pool.run(work_dir, self.post_process.__name__, prune, timings, staging)
+
+            (result, pruned, rank) = (reply[REPLY_RESULT], bool(reply[REPLY_PRUNED]), int(reply[REPLY_RANK]))
+
+            # the worker's share of the dispatch, split into Smilei's initialisation and PIC loop
+            timings["dispatch"] -= timings["wait"]
+            timings["simulate"] = reply[REPLY_WALL]
+            timings["init"] = reply[REPLY_WALL] - reply[REPLY_LOOP]
+            timings["loop"] = reply[REPLY_LOOP]
+            timings["worker_post"] = reply[REPLY_POST]
+            timings["peak_rss_bytes"] = reply[REPLY_RSS]
+            timings["output_bytes"] = reply[REPLY_OUTPUT]
+        else:
+            self.spawn_sim(work_dir, par_vec, timings, fidelity)
+            (result, pruned, rank) = (np.nan, False, -1)
+
+        # perform post-processing, unless a worker already has - a staged work directory is not
+        # visible here, so the worker's result is final
+        if np.isnan(result) and work_dir is not None:
+            with timed(timings, "analysis_wait"):
+                self.analysis_semaphore.acquire()
+
+            try:
+                with timed(timings, "post_process"):
+                    result = self.post_process(work_dir)
+            finally:
+                self.analysis_semaphore.release()
+
+        # a failed simulation or post-process, reported by a worker as NaN, must lose every
+        # comparison - SciPy's argmin would otherwise make it the best member for good
+        if not np.isfinite(result):
+            logger.warning(f"Smilei Simulation at fidelity {fidelity:g} gave no usable result ({result}), recording it as infinitely bad, parameters: {pp_array(par_vec)}")
+            (result, pruned) = (np.inf, False)
+
+        if pruned:
+            logger.debug(f"Smilei Simulation pruned, bound on result: {-result:.3e}, parameters: {pp_array(par_vec)}")
+        else:
+            logger.debug(f"Smilei Simulation finished at fidelity {fidelity:g}, got result: {-result:.3e}, parameters: {pp_array(par_vec)}")
+
+            # a pruned result is only a bound, so is not worth caching, and a failed simulation or
+            # post-process may well succeed next time
+            if self.cache is not None and fidelity == 1. and np.isfinite(result):
+                self.cache.put(par_vec, result)
 
-        # Create parameter file
-        with open(f"{work_dir}/par_vec.npy", "wb") as par_vec_file:
-            np.save(par_vec_file, par_vec, allow_pickle=False)
+        if work_dir is not None:
+            if "output_bytes" not in timings:
+                timings["output_bytes"] = output_size(work_dir)
+
+            # tidy up in the background, off the critical path
+            self.cleaner.remove(work_dir)
+
+        self.write_result(par_vec, result, time.perf_counter() - start, rank, pruned, timings=timings, fidelity=fidelity)
+
+        # finally, return result
+        return (result, not pruned and fidelity == 1. and np.isfinite(result))
+
+    def write_result(self, par_vec: np.ndarray, result: float, runtime: float, rank: int = -1, pruned: bool = False, cached: bool = False, timings: dict = None, fidelity: float = 1.):
+        """
+        Record a processed result in the trial store for its fidelity, against the current
+        generation, and publish it along with its phase timings and the current load on the workers
+
+        The phases of simulations below full fidelity are aggregated separately, suffixed with
+        their fidelity.
+        """
+        generation = -1 if self.generation is None else self.generation
+
+        timings = {} if timings is None else timings
+
+        if fidelity < 1.:
+            self.timings.add({f"{phase}@{fidelity:g}": value for (phase, value) in timings.items()})
+            self.screening_trials[fidelity].put(par_vec, result, generation, runtime, rank, pruned, cached)
+        else:
+            self.timings.add(timings)
+            self.trials.put(par_vec, result, generation, runtime, rank, pruned, cached)
+
+        # simulations waiting for a worker are only possible with a pool
+        busy = self.in_flight if self.pool is None else self.pool.slots - self.pool.idle.qsize()
+
+        self.metrics.publish(
+            "trial",
+            generation=generation,
+            energy=result,
+            runtime=runtime,
+            rank=rank,
+            pruned=pruned,
+            cached=cached,
+            fidelity=fidelity,
+            in_flight=self.in_flight,
+            busy=busy,
+            workers=self.pool_size if self.pool is None else self.pool.slots,
+            queued=max(self.in_flight - busy, 0),
+            timings=timings
+        )
+
+    def spawn_sim(self, work_dir: str, par_vec: np.ndarray, timings: dict, fidelity: float = 1.):
+        """
+        Spawn a smilei_sub process for a single simulation and wait for it to exit
+
+        Threads spawn concurrently, each from its own duplicate of COMM_SELF, as a spawn is
+        collective over the communicator it is called on. Spawn_multiple is not used, as it would
+        put every child in one MPI_COMM_WORLD, making Smilei run them as a single simulation.
+
+        The time spent waiting for a spawn slot, spawning and simulating is added to timings
+        """
+        logger = logging.getLogger("supervisor")
 
         # set working directory for child process
         info = MPI.Info.Create()
         info.Set("wdir", work_dir)
 
+        if (comm := getattr(self.spawn_comms, "comm", None)) is None:
+            # duplicating is itself collective over COMM_SELF, so only one thread may do it at a time
+            with self.spawn_comms_lock:
+                comm = self.spawn_comms.comm = MPI.COMM_SELF.Dup()
+
         # spawn smilei child process
-        with self.mpi_spawn_lock:
-            logger.debug(f"Starting Smilei simulation with parameters: {pp_array(par_vec)}")
-
-            inter = MPI.COMM_SELF.Spawn(
-                command = "smilei_sub",
-                args=[
-                    bytes(self.namelist.resolve())
-                ],
-                maxprocs=1,
-                info=info
-            )
+        with timed(timings, "wait"):
+            self.spawn_semaphore.acquire()
+
+        try:
+            logger.debug(f"Starting Smilei simulation at fidelity {fidelity:g} with parameters: {pp_array(par_vec)}")
+
+            with timed(timings, "spawn"):
+                inter = comm.Spawn(
+                    command = "smilei_sub",
+                    args=[
+                        bytes(self.namelist.resolve())
+                    ],
+                    maxprocs=1,
+                    info=info
+                )
 
             logger.debug("Process spawned, waiting for completion")
+        finally:
+            self.spawn_semaphore.release()
 
-        # wait for smilei to finish (yielding to other threads)
-        req = inter.Ibarrier()
-        while not req.Test():
-            time.sleep(0.01)
+        # wait for smilei to finish - the dispatcher wakes us once the barrier completes
+        with timed(timings, "simulate"):
+            self.dispatcher.wait(inter.Ibarrier())
 
         inter.Disconnect()
 
-        # perform post-processing
-        with self.analysis_semaphore:
-            result = self.post_process(work_dir)
-
-        logger.debug(f"Smilei Simulation finished, got result: {-result:.3e}, parameters: {pp_array(par_vec)}")
+    def start_pool(self):
+        """
+        Spawn the long-lived worker pool, if this wrapper was configured to use one
+        """
+        if self.pool_size is not None and self.pool is None:
+            self.pool = WorkerPool(self.namelist, self.pool_size, self.dispatcher, self.batch)
 
-        # write processed result to current gen file
-        with open(
-            f"gen{self.generation:0>3d}.csv" if self.generation is not None else "geninit.csv",
-            'a'
-        ) as gen_file:
-            xs = ','.join([str(x) for x in par_vec])
-            print(xs, -result, sep=',', file=gen_file)
+    @property
+    def slots(self) -> Optional[int]:
+        """
+        The number of simulations the worker pool can run at once, which grows once a pool choosing
+        its own batch size has chosen it, or None without a pool
+        """
+        return None if self.pool is None else self.pool.slots
 
-        logger.debug("Written results to generation file")
+    def stop_pool(self):
+        """
+        Stop the worker pool, if running
+        """
+        if self.pool is not None:
+            self.pool.close()
+            self.pool = None
 
-        # tidy up - log failure but do nothing about it now - failures probably due to latency on HPC ephemeral store
-        shutil.rmtree(
-            work_dir,
-            onerror=lambda _f, p, e: logger.warning(f"Failed to delete {p} as {e}")
-        )
+    def _screening_trials(self) -> dict:
+        """
+        A trial store for each fidelity of the ladder, keeping results below full fidelity apart
+        from those of full simulations
+        """
+        if self.fidelity is None:
+            return {}
 
-        logger.debug("Attempted to remove temp dir")
+        return {level: TrialStore(pathlib.Path(f"trials_{level:g}")) for level in self.fidelity[0]}
 
-        # finally, return result
-        return result
+    def close(self):
+        """
+        Stop the worker pool and write out any trials still queued for the trial stores
+        """
+        self.stop_pool()
+        self.cleaner.close()
+        self.trials.close()
+        for screening_trials in self.screening_trials.values():
+            screening_trials.close()
+        self.metrics.close()
 
     def __getstate__(self):
         state = self.__dict__.copy()
-        del state['mpi_spawn_lock']
+        del state['spawn_semaphore']
+        del state['spawn_comms']
+        del state['spawn_comms_lock']
+        del state['cleaner']
+        del state['in_flight_lock']
+        state['in_flight'] = 0
         del state['analysis_semaphore']
+        del state['dispatcher']
+        state['pool'] = None
         return state
 
     def __setstate__(self, state):
+        state.setdefault('prune', None)
+        if (prune := state['prune']) is not None and len(prune) == 3:
+            # earlier versions always pruned on the goal function itself
+            prune = state['prune'] = (state['post_process'].__name__, *prune)
+        if prune is not None and not isinstance(prune[1], tuple):
+            # and with a single factor throughout the run
+            state['prune'] = (prune[0], (prune[1],), *prune[2:])
+        # earlier versions always spawned one simulation at a time
+        state.setdefault('spawn_concurrency', 1)
+        state.setdefault('scratch', None)
+        state.setdefault('artifacts', ())
+        state.setdefault('fidelity', None)
+        state.setdefault('batch', 1)
+        if 'trials' not in state:
+            state['trials'] = TrialStore(pathlib.Path("trials"))
+        if 'metrics' not in state:
+            state['metrics'] = MetricsPublisher(pathlib.Path("metrics.jsonl"))
+        if 'timings' not in state:
+            state['timings'] = PhaseTimings()
         self.__dict__.update(state)
-        self.mpi_spawn_lock = threading.Lock()
+        if 'screening_trials' not in state:
+            self.screening_trials = self._screening_trials()
+        self.in_flight = 0
+        self.in_flight_lock = threading.Lock()
+        self.spawn_semaphore = threading.Semaphore(self.spawn_concurrency or 2**31 - 1)
+        self.spawn_comms = threading.local()
+        self.spawn_comms_lock = threading.Lock()
+        self.cleaner = Cleaner()
         self.analysis_semaphore = threading.Semaphore(self.analysis_concurrency)
+        self.dispatcher = CompletionDispatcher()
@@ -0,0 +1,85 @@
+import numpy as np
+
+from scipy.linalg import LinAlgError, cho_factor, cho_solve
+from scipy.special import ndtr
+from typing import Tuple
+
+# the length scales tried when fitting, relative to the diagonal of the unit hypercube, and the
+# noise variances tried, relative to the variance of the energies
+LENGTH_SCALES = np.geomspace(0.02, 1., 9)
+NOISES = (1e-4, 1e-2, 1e-1)
+
+class GaussianProcess:
+    """
+    A Gaussian process regression of trial energies over the normalised parameter space
+
+    The kernel is an isotropic squared exponential, whose length scale and noise are chosen from a
+    small grid by maximising the marginal likelihood, so fitting needs nothing beyond NumPy and
+    SciPy. Only the most recent results are fitted, which keeps the cost of a fit bounded however
+    long the optimisation runs.
+    """
+    def __init__(self, max_points: int = 500):
+        """
+        Arguments:
+        max_points -- the most results fitted, the oldest being dropped first
+        """
+        self.max_points = max_points
+        self.x = None
+
+    @property
+    def fitted(self) -> bool:
+        return self.x is not None
+
+    def fit(self, x: np.ndarray, y: np.ndarray):
+        """
+        Fit the model to trials x, normalised to [0, 1] with shape (M, N), and their energies y,
+        shape (M,)
+        """
+        (x, y) = (x[-self.max_points:], y[-self.max_points:])
+
+        self.y_mean = np.mean(y)
+        self.y_scale = np.std(y) or 1.
+        z = (y - self.y_mean) / self.y_scale
+
+        distances = _squared_distances(x, x)
+        best = None
+
+        for length_scale in LENGTH_SCALES * np.sqrt(x.shape[1]):
+            kernel = np.exp(-distances / (2 * length_scale**2))
+
+            for noise in NOISES:
+                try:
+                    factor = cho_factor(kernel + noise * np.eye(len(x)), lower=True)
+                except LinAlgError:
+                    continue
+
+                alpha = cho_solve(factor, z)
+                log_likelihood = -0.5 * z @ alpha - np.sum(np.log(np.diag(factor[0])))
+
+                if best is None or log_likelihood > best[0]:
+                    best = (log_likelihood, length_scale, factor, alpha)
+
+        (_, self.length_scale, self.factor, self.alpha) = best
+        self.x = x
+
+    def predict(self, x: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        The predicted mean energy of each of trials x, and its standard deviation
+        """
+        kernel = np.exp(-_squared_distances(x, self.x) / (2 * self.length_scale**2))
+
+        mean = kernel @ self.alpha
+        variance = 1. - np.sum(kernel.T * cho_solve(self.factor, kernel.T), axis=0)
+
+        return self.y_mean + self.y_scale * mean, self.y_scale * np.sqrt(np.maximum(variance, 1e-12))
+
+    def improvement_probability(self, x: np.ndarray, targets: np.ndarray) -> np.ndarray:
+        """
+        The probability that each of trials x has a lower energy than its target
+        """
+        (mean, std) = self.predict(x)
+        return ndtr((targets - mean) / std)
+
+
+def _squared_distances(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    return np.maximum(np.sum(a**2, axis=1)[:, None] + np.sum(b**2, axis=1)[None, :] - 2 * a @ b.T, 0.)
@@ -0,0 +1,144 @@
+import json
+import logging
+import numpy as np
+import pathlib
+import queue
+import threading
+
+# the columns recorded for every trial, and their types. par_vec is the only column with a row
+# shape, which is only known once the first trial arrives
+COLUMNS = {
+    "par_vec": np.float64,
+    "energy": np.float64,
+    "generation": np.int32,
+    "runtime": np.float64,
+    "rank": np.int32,
+    "pruned": np.bool_,
+    "cached": np.bool_
+}
+
+class TrialStore:
+    """
+    A binary, columnar log of every trial's parameters and result
+
+    Each column is a raw array appended to its own file, described by header.json, so analysis can
+    memory-map a column without parsing text or reading any other. Trials are queued by the
+    simulation threads and written in batches by a single writer thread, so rows never interleave
+    and the filesystem sees one write per column per batch rather than an open per result.
+    """
+    def __init__(self, directory: pathlib.Path, batch_size: int = 64, batch_wait: float = 1.):
+        """
+        Arguments:
+        directory -- where to keep the columns, created if necessary. An existing store is
+            appended to
+        batch_size -- the most trials written in one batch
+        batch_wait -- the longest a trial waits for others to join its batch, in seconds
+        """
+        self.directory = directory
+        self.batch_size = batch_size
+        self.batch_wait = batch_wait
+        self.queue = queue.Queue()
+
+        self.directory.mkdir(parents=True, exist_ok=True)
+
+        self.writer = threading.Thread(target=self._write, name="trial-store", daemon=True)
+        self.writer.start()
+
+    def put(self, par_vec: np.ndarray, energy: float, generation: int, runtime: float, rank: int, pruned: bool = False, cached: bool = False):
+        """
+        Queue a trial to be written
+
+        Arguments:
+        par_vec -- the trial's parameters
+        energy -- its goal value, as minimised by the solver
+        generation -- the generation it belongs to, -1 for the initial population
+        runtime -- the time taken to produce the result, in seconds
+        rank -- the rank of the pool worker which ran it, -1 if it was not run by a worker
+        pruned -- whether the simulation was stopped early, and energy is only a bound
+        cached -- whether energy was found in the result cache
+        """
+        self.queue.put((par_vec, energy, generation, runtime, rank, pruned, cached))
+
+    def close(self):
+        """
+        Write any queued trials and stop the writer thread
+        """
+        self.queue.put(None)
+        self.writer.join()
+
+    def _write(self):
+        logger = logging.getLogger("supervisor")
+
+        files = None
+        closing = False
+
+        while not closing:
+            batch = [self.queue.get()]
+
+            # gather whatever else arrives shortly after, up to a full batch
+            while batch[-1] is not None and len(batch) < self.batch_size:
+                try:
+                    batch.append(self.queue.get(timeout=self.batch_wait))
+                except queue.Empty:
+                    break
+
+            if batch[-1] is None:
+                closing = True
+                batch.pop()
+
+            if not batch:
+                continue
+
+            if files is None:
+                files = self._open(len(batch[0][0]))
+
+            try:
+                for (name, column) in zip(COLUMNS, zip(*batch)):
+                    files[name].write(np.asarray(column, dtype=COLUMNS[name]).tobytes())
+                    files[name].flush()
+            except OSError as e:
+                logger.warning(f"Failed to write {len(batch)} trials to {self.directory} as {e}")
+            else:
+                logger.debug(f"Written {len(batch)} trials to {self.directory}")
+
+        if files is not None:
+            for trial_file in files.values():
+                trial_file.close()
+
+    def _open(self, dims: int) -> dict:
+        """
+        Write the header, unless appending to an existing store, and open every column for appending
+
+        A run killed part way through a batch can leave some columns a row longer than others, so
+        every column is cut back to the rows which are complete in all of them.
+        """
+        row_sizes = {name: np.dtype(dtype).itemsize * (dims if name == "par_vec" else 1) for (name, dtype) in COLUMNS.items()}
+        paths = {name: self.directory / f"{name}.bin" for name in COLUMNS}
+
+        rows = min(path.stat().st_size // row_sizes[name] if path.exists() else 0 for (name, path) in paths.items())
+
+        if not (header_path := self.directory / "header.json").exists():
+            header = {
+                "columns": {
+                    name: {
+                        "dtype": np.dtype(dtype).str,
+                        "shape": [dims] if name == "par_vec" else []
+                    } for (name, dtype) in COLUMNS.items()
+                }
+            }
+
+            with open(header_path, "w") as header_file:
+                json.dump(header, header_file, indent=2)
+
+        files = {name: open(path, "ab") for (name, path) in paths.items()}
+
+        for (name, trial_file) in files.items():
+            trial_file.truncate(rows * row_sizes[name])
+
+        return files
+
+    def __getstate__(self):
+        return {"directory": self.directory, "batch_size": self.batch_size, "batch_wait": self.batch_wait}
+
+    def __setstate__(self, state):
+        self.__init__(**state)
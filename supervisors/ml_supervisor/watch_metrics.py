@@ -0,0 +1,131 @@
+"""
+Follow the metrics published by a running optimisation, printing generations as they complete and
+a periodic summary of the trials, so stalled or badly bounded runs can be spotted and killed early.
+
+Only new lines are read on each poll, so the viewer stays cheap however long the run has been going.
+It needs nothing beyond the standard library, so can be run on a login node or over a copy of the
+file.
+"""
+import argparse
+import collections
+import json
+import pathlib
+import statistics
+import sys
+import time
+
+parser = argparse.ArgumentParser(description="Follow the progress metrics of a running optimisation")
+parser.add_argument(
+    "metrics",
+    type=pathlib.Path,
+    nargs="?",
+    default=pathlib.Path("metrics.jsonl"),
+    help="The metrics file to follow, by default metrics.jsonl in the current directory"
+)
+parser.add_argument(
+    "--interval",
+    default=10.,
+    type=float,
+    help="The number of seconds between polls of the metrics file"
+)
+parser.add_argument(
+    "--window",
+    default=100,
+    type=int,
+    help="The number of recent trials summarised"
+)
+parser.add_argument(
+    "--stall",
+    default=3.,
+    type=float,
+    help="Warn if no trial has completed for this many times the median recent simulation runtime"
+)
+parser.add_argument(
+    "--once",
+    action="store_true",
+    help="Print everything published so far and a summary, then exit rather than following the file"
+)
+
+class Follower:
+    """
+    Reads the lines appended to a file since the last read, leaving any partial last line for later
+    """
+    def __init__(self, path: pathlib.Path):
+        self.path = path
+        self.offset = 0
+        self.partial = b""
+
+    def read(self) -> list:
+        try:
+            with open(self.path, "rb") as metrics_file:
+                metrics_file.seek(self.offset)
+                data = self.partial + metrics_file.read()
+                self.offset = metrics_file.tell()
+        except FileNotFoundError:
+            return []
+
+        *lines, self.partial = data.split(b"\n")
+        return [json.loads(line) for line in lines if line]
+
+def print_generation(event: dict):
+    print(
+        f"Generation {event['generation']:>4d}: best {-event['best']:.3e}, "
+        f"mean {-event['mean']:.3e} ± {event['std']:.3e}, "
+        f"convergence {event['convergence']:.3e}, {event['nfev']} evaluations"
+    )
+
+def print_summary(trials: collections.deque, screening: collections.deque, last_trial: float, stall: float):
+    if screening:
+        runtimes = [t["runtime"] for t in screening]
+        print(f"  {len(screening)} recent screening runs below full fidelity: median runtime {statistics.median(runtimes):.1f} s")
+
+    if not trials:
+        print("No trials yet")
+        return
+
+    latest = trials[-1]
+    runtimes = [t["runtime"] for t in trials if not t["cached"]]
+    median = statistics.median(runtimes) if runtimes else 0.
+    span = latest["time"] - trials[0]["time"]
+    rate = 3600 * (len(trials) - 1) / span if span > 0 else 0.
+
+    utilisation = ""
+    if latest["workers"]:
+        utilisation = f", {latest['busy']}/{latest['workers']} workers busy"
+
+    print(
+        f"  {len(trials)} recent trials: {rate:.1f} per hour, median runtime {median:.1f} s, "
+        f"{sum(t['pruned'] for t in trials)} pruned, {sum(t['cached'] for t in trials)} cached, "
+        f"best {-min(t['energy'] for t in trials):.3e}{utilisation}, {latest['queued']} queued"
+    )
+
+    if median > 0 and (idle := time.time() - last_trial) > stall * median:
+        print(f"  WARNING: no trial has completed for {idle:.0f} s, {idle / median:.1f} times the median runtime")
+
+def main():
+    args = parser.parse_args()
+
+    follower = Follower(args.metrics)
+    trials = collections.deque(maxlen=args.window)
+    screening = collections.deque(maxlen=args.window)
+    last_trial = time.time()
+
+    while True:
+        for event in follower.read():
+            if event["kind"] == "generation":
+                print_generation(event)
+            elif event["kind"] == "trial":
+                # runs below full fidelity are summarised apart, as their runtimes are far shorter
+                (trials if event.get("fidelity", 1.) == 1. else screening).append(event)
+                last_trial = event["time"]
+
+        print_summary(trials, screening, last_trial, args.stall)
+        sys.stdout.flush()
+
+        if args.once:
+            break
+
+        time.sleep(args.interval)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,328 @@
+"""
+A long-lived worker, spawned once by WorkerPool, which runs Smilei simulations on request
+
+The worker receives commands from rank 0 of its parent over the intercommunicator. Each "run"
+command names a work directory, which already contains par_vec.npy (and fidelity.npy below full
+fidelity), and a goal function. The worker runs smilei_sub in the work directory as a local child
+process, applies the goal function as soon as it exits and sends the result back to the parent in
+its reply. If anything goes wrong in the worker, the reply still comes, with a nonzero status and a
+NaN result. A "stop" command disconnects from the parent and exits.
+
+A run command may instead carry staging settings, in which case the worker creates the work
+directory itself under a node-local scratch root, copies back only the declared artifacts once the
+simulation has been post-processed, and deletes the work directory in the background after
+replying.
+
+A worker may be given several simulations at once, each in its own slot, in which case they run
+concurrently and share the worker's OpenMP threads.
+
+A run command may also carry pruning settings. The worker then periodically evaluates a goal
+function on the running simulation's diagnostics and terminates it early once even an optimistic
+bound on its final value cannot beat the population member it competes with.
+"""
+import fnmatch
+import logging
+import os
+import re
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+import numpy as np
+
+from mpi4py import MPI
+
+import goal_functions
+
+from cleanup import Cleaner
+from protocol import REPLY_LOOP, REPLY_OUTPUT, REPLY_POST, REPLY_PRUNED, REPLY_RANK, REPLY_RESULT, REPLY_RSS, REPLY_SIZE, REPLY_STATUS, REPLY_WALL, TAG_COMMAND, TAG_REPLY, output_size, write_inputs
+
+# seconds between checks for new commands while simulations are running
+POLL_INTERVAL = 0.1
+
+# smilei_sub's output is kept in the work directory, and searched for Smilei's own timer of the
+# PIC loop once it exits
+SMILEI_LOG = "smilei.log"
+TIME_LOOP_RE = re.compile(rb"Time[ _]in[ _]time[ _]loop\s*:?\s*([0-9.eE+-]+)")
+
+# variables set by the MPI launcher for this worker, which would make smilei_sub try to join our
+# job rather than starting as a singleton
+MPI_ENV_PREFIXES = ("OMPI_", "PMIX_", "PMI_")
+
+
+def child_env() -> dict:
+    """
+    The environment for smilei_sub, stripped of anything identifying this worker to the MPI runtime
+    """
+    return {k: v for k, v in os.environ.items() if not k.startswith(MPI_ENV_PREFIXES)}
+
+
+def reap(process: subprocess.Popen, timeout: float = None):
+    """
+    Wait for a child to exit, returning its resource usage, which Popen.wait would discard
+
+    Arguments:
+    process -- the child
+    timeout -- the longest to wait in seconds, by default forever
+
+    Returns:
+    The child's resource usage, or None if it was still running at the timeout
+    """
+    deadline = None if timeout is None else time.monotonic() + timeout
+
+    while True:
+        (pid, status, rusage) = os.wait4(process.pid, 0 if timeout is None else os.WNOHANG)
+
+        if pid != 0:
+            process.returncode = os.waitstatus_to_exitcode(status)
+            return rusage
+
+        if (remaining := deadline - time.monotonic()) <= 0:
+            return None
+
+        time.sleep(min(remaining, 0.5))
+
+
+def time_in_loop(work_dir: str) -> float:
+    """
+    Read the time Smilei spent in its PIC loop from its output, or NaN if it did not report one
+    """
+    try:
+        with open(f"{work_dir}/{SMILEI_LOG}", "rb") as log_file:
+            matches = TIME_LOOP_RE.findall(log_file.read())
+    except OSError:
+        return np.nan
+
+    return float(matches[-1]) if matches else np.nan
+
+
+def stage_in(scratch: str, par_vec: np.ndarray, fidelity: float = 1.) -> str:
+    """
+    Create a work directory under scratch holding the input files, returning its path
+
+    Environment variables in scratch are expanded on this node, so it can name node-local storage
+    such as $TMPDIR
+    """
+    os.makedirs(scratch := os.path.expandvars(scratch), exist_ok=True)
+    work_dir = tempfile.mkdtemp(dir=scratch)
+
+    write_inputs(work_dir, par_vec, fidelity)
+
+    return work_dir
+
+
+def stage_out(work_dir: str, artifact_dir: str, patterns: list):
+    """
+    Copy the files in the top level of work_dir matching any of patterns into artifact_dir
+    """
+    logger = logging.getLogger("worker")
+
+    if not (names := [name for name in os.listdir(work_dir) if any(fnmatch.fnmatch(name, p) for p in patterns)]):
+        return
+
+    os.makedirs(artifact_dir, exist_ok=True)
+
+    for name in names:
+        try:
+            shutil.copy2(os.path.join(work_dir, name), artifact_dir)
+        except OSError as e:
+            logger.warning(f"Failed to copy {name} from {work_dir} to {artifact_dir} as {e}")
+
+
+def log_tail(work_dir: str, lines: int = 20) -> str:
+    """
+    The last lines of Smilei's output, as the work directory is deleted once the supervisor is done
+    """
+    try:
+        with open(f"{work_dir}/{SMILEI_LOG}", "rb") as log_file:
+            return b"\n".join(log_file.read().splitlines()[-lines:]).decode(errors="replace")
+    except OSError as e:
+        return repr(e)
+
+
+def wait_or_prune(process: subprocess.Popen, work_dir: str, prune: tuple) -> tuple:
+    """
+    Wait for smilei_sub to exit, terminating it early if it cannot beat its target
+
+    Arguments:
+    process -- the running smilei_sub
+    work_dir -- its work directory
+    prune -- (target, goal, factors, min_dumps, interval): the goal value to beat; the name of the
+        goal function evaluated on the running simulation, which need not be the one applied once
+        it exits; the factors bounding how much the interim goal value can still improve by the end
+        of the run, each applying over an equal fraction of the run in turn; the number of dumps
+        needed before the bound is trusted; and the number of seconds between checks
+
+    Returns:
+    The bound on the final goal value if the simulation was terminated, otherwise NaN, and the
+    child's resource usage
+    """
+    logger = logging.getLogger("worker")
+
+    (target, goal, factors, min_dumps, interval) = prune
+
+    while True:
+        if (rusage := reap(process, interval)) is not None:
+            return np.nan, rusage
+
+        if (interim := goal_functions.interim_goal(goal, work_dir, min_dumps)) is None:
+            continue
+
+        # without the length of the run, only the factor for its start is safe
+        (value, fraction) = interim
+        factor = factors[0] if np.isnan(fraction) else factors[min(int(fraction * len(factors)), len(factors) - 1)]
+
+        # goal values are negated, so lower is better
+        if (bound := factor * value) > target:
+            logger.info(f"Pruning {work_dir}: bound {-bound:.3e} cannot beat {-target:.3e}")
+            process.terminate()
+            return bound, reap(process)
+
+
+def simulate(namelist: str, env: dict, rank: int, args: tuple) -> tuple:
+    """
+    Run a single simulation and post-process it
+
+    Arguments:
+    namelist -- path to the namelist
+    env -- the environment for smilei_sub
+    rank -- this worker's rank, returned in the reply
+    args -- the run command's arguments, see WorkerPool.run
+
+    Returns:
+    The reply, and the work directory if it was staged and so is the worker's to delete, else None
+    """
+    logger = logging.getLogger("worker")
+
+    (work_dir, goal, prune, staging, _, threads) = args
+
+    reply = np.full(REPLY_SIZE, np.nan)
+    reply[REPLY_RANK] = rank
+    staged_dir = None
+
+    try:
+        if staging is not None:
+            (scratch, par_vec, fidelity, artifact_dir, patterns) = staging
+            staged_dir = work_dir = stage_in(scratch, par_vec, fidelity)
+
+        run(namelist, env, work_dir, goal, prune, threads, reply)
+
+        if staged_dir is not None:
+            stage_out(work_dir, artifact_dir, patterns)
+    except Exception:
+        # the supervisor waits on every reply, so a failure must still send one
+        logger.exception(f"Simulation in {work_dir} failed")
+        reply[REPLY_STATUS] = -1
+        reply[REPLY_RESULT] = np.nan
+        reply[REPLY_PRUNED] = False
+
+    return reply, staged_dir
+
+
+def run(namelist: str, env: dict, work_dir: str, goal: str, prune: tuple, threads: int, reply: np.ndarray):
+    """
+    Run a simulation in work_dir and post-process it, filling in reply as it goes
+    """
+    logger = logging.getLogger("worker")
+
+    if threads is not None:
+        # the worker's threads are shared between its simulations, which must not all bind to the
+        # same cores
+        env = {**env, "OMP_NUM_THREADS": str(threads), "OMP_PROC_BIND": "false"}
+
+    start = time.perf_counter()
+
+    with open(f"{work_dir}/{SMILEI_LOG}", "wb") as log_file:
+        process = subprocess.Popen(["smilei_sub", namelist], cwd=work_dir, env=env, stdout=log_file, stderr=subprocess.STDOUT)
+
+    if prune is None:
+        (bound, rusage) = (np.nan, reap(process))
+    else:
+        (bound, rusage) = wait_or_prune(process, work_dir, prune)
+
+    reply[REPLY_WALL] = time.perf_counter() - start
+    reply[REPLY_LOOP] = time_in_loop(work_dir)
+    reply[REPLY_RSS] = rusage.ru_maxrss * 1024  # kB on Linux
+    reply[REPLY_STATUS] = process.returncode
+    reply[REPLY_PRUNED] = not np.isnan(bound)
+
+    if reply[REPLY_PRUNED]:
+        reply[REPLY_RESULT] = bound
+        reply[REPLY_POST] = 0.
+    else:
+        if process.returncode != 0:
+            logger.warning(f"smilei_sub exited with {process.returncode} in {work_dir}, its output ended:\n{log_tail(work_dir)}")
+
+        start = time.perf_counter()
+
+        try:
+            reply[REPLY_RESULT] = getattr(goal_functions, goal)(work_dir)
+        except Exception as e:
+            logger.warning(f"Post-processing failed in {work_dir}: {e!r}")
+            reply[REPLY_RESULT] = np.nan
+
+        reply[REPLY_POST] = time.perf_counter() - start
+
+    reply[REPLY_OUTPUT] = output_size(work_dir)
+
+
+def main():
+    logging.basicConfig(
+        stream=sys.stdout,
+        level=logging.INFO,
+        format="%(levelname)s on worker %(process)d at %(asctime)s: %(message)s"
+    )
+    logger = logging.getLogger("worker")
+
+    parent = MPI.Comm.Get_parent()
+    if parent == MPI.COMM_NULL:
+        logger.error("Worker must be spawned by a supervisor")
+        sys.exit(1)
+
+    # Smilei holds its diagnostics open for writing, so reading them mid-run needs locking disabled
+    os.environ.setdefault("HDF5_USE_FILE_LOCKING", "FALSE")
+
+    namelist = sys.argv[1]
+    env = child_env()
+    rank = MPI.COMM_WORLD.Get_rank()
+    cleaner = Cleaner("worker")
+
+    # simulations run on threads, each replying on its slot's tag, while every MPI call stays on
+    # this thread. The supervisor never sends more simulations than the worker has slots
+    executor = ThreadPoolExecutor(thread_name_prefix="simulation")
+    running = {}  # future -> slot
+    stopping = False
+
+    while not stopping or running:
+        # block for the next command when idle, otherwise poll between checks on the simulations
+        while not stopping and (not running or parent.Iprobe(source=0, tag=TAG_COMMAND)):
+            command, args = parent.recv(source=0, tag=TAG_COMMAND)
+
+            if command == "stop":
+                stopping = True
+            else:
+                running[executor.submit(simulate, namelist, env, rank, args)] = args[4]
+
+        (done, _) = wait(running, timeout=POLL_INTERVAL, return_when=FIRST_COMPLETED)
+
+        for future in done:
+            slot = running.pop(future)
+            (reply, staged_dir) = future.result()
+
+            parent.Send([reply, MPI.DOUBLE], dest=0, tag=TAG_REPLY + slot)
+
+            # the supervisor never sees a staged work directory, so it is the worker's to delete
+            if staged_dir is not None:
+                cleaner.remove(staged_dir)
+
+    executor.shutdown()
+    cleaner.close()
+    parent.Disconnect()
+
+
+if __name__ == "__main__":
+    main()